@@ -6,6 +6,6 @@ echo "Collecting static files..."
 python3 manage.py collectstatic --noinput --settings=todo_app_be.settings.production
 
 echo "Running migrations..."
-python3 manage.py migrate --settings=todo_app_be.settings.production
+python3 manage.py migrate_shards --settings=todo_app_be.settings.production
 
 echo "Build completed"
\ No newline at end of file
@@ -47,15 +47,32 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # After CORS so that shed requests still carry the CORS headers
     'corsheaders.middleware.CorsMiddleware',
+    'todos.middleware.ConcurrencyLimitMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'todos.middleware.PathScopedMiddleware',
+]
+
+# Browser middleware run by PathScopedMiddleware, except on the token
+# authenticated API paths below
+SCOPED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+LEAN_MIDDLEWARE_PATHS = [
+    '/api/',
+    '/api-token-auth/',
+]
+
+# The admin's middleware checks only look at MIDDLEWARE; the session, auth
+# and messages middleware it needs run through SCOPED_MIDDLEWARE instead.
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+
 ROOT_URLCONF = 'todo_app_be.urls'
 
 TEMPLATES = [
@@ -87,6 +104,30 @@ DATABASES = {
     }
 }
 
+# Task data is sharded by user (see todos.sharding). Users, tokens and the
+# other shared tables stay on TASK_DIRECTORY_DB; TASK_SHARDS may only be
+# appended to, followed by `manage.py rebalance_shards`.
+DATABASE_ROUTERS = ['todos.sharding.UserShardRouter']
+TASK_DIRECTORY_DB = 'default'
+TASK_SHARDS = ['default']
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The 'throttle' cache holds the API rate limit buckets when THROTTLE_STORE
+# is the cache store. Its incr() must be atomic, so use local memory, Redis
+# or Memcached here, not the database cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -130,13 +171,56 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
+    # Token only: the API paths skip the session middleware (see
+    # LEAN_MIDDLEWARE_PATHS), so a session from the /api-auth/ login is
+    # never seen there and cookies alone cannot call the API
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'todos.throttling.UserTokenBucketThrottle',
+        'todos.throttling.IPTokenBucketThrottle',
+    ],
+    # Keyed by '<view throttle_scope>_<user|ip>'
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '20/min',
+        'tasks_user': '300/min',
+        'tasks_ip': '600/min',
+    },
+    # Proxies in front of the app whose X-Forwarded-For entries are trusted.
+    # 0 keys IP buckets on REMOTE_ADDR; left unset, DRF would key them on the
+    # client-supplied header and a new value per request would skip the limit.
+    'NUM_PROXIES': 0,
+}
+
+# Where rate limit buckets are kept: CacheBucketStore (the 'throttle' cache)
+# or DatabaseBucketStore (shared between workers through the database)
+THROTTLE_STORE = 'todos.throttling.CacheBucketStore'
+
+# Task change log: 'buffered' (write-behind), 'sync' (write before the
+# response) or 'off'. Buffered rows are flushed after each response, once
+# MAX_BUFFER rows are queued or once the oldest is FLUSH_INTERVAL seconds old.
+TASK_HISTORY = {
+    'MODE': 'buffered',
+    'MAX_BUFFER': 500,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+# Per-worker cap on requests in flight, by the first matching path prefix
+ADMISSION_CONTROL = {
+    'ROUTES': [
+        ('/api/auth/', 'auth'),
+        ('/api-token-auth/', 'auth'),
+        ('/api/', 'tasks'),
+    ],
+    'CONCURRENCY': {
+        'auth': 4,
+        'tasks': 32,
+    },
+    'RETRY_AFTER': 1,
 }
 
 CORS_ALLOWED_ORIGINS = [
@@ -23,6 +23,21 @@ if 'DATABASE_URL' in os.environ:
         )
     }
 
+    # Additional task shards, in order: TASK_SHARD_URLS=postgres://...,postgres://...
+    shard_urls = [url for url in os.environ.get('TASK_SHARD_URLS', '').split(',') if url]
+    for index, url in enumerate(shard_urls, start=1):
+        DATABASES[f'shard_{index}'] = dj_database_url.parse(
+            url, conn_max_age=600, conn_health_checks=True,
+        )
+    TASK_SHARDS = ['default'] + [f'shard_{index}' for index in range(1, len(shard_urls) + 1)]
+
+    # Share throttle buckets across serverless instances
+    THROTTLE_STORE = 'todos.throttling.DatabaseBucketStore'
+
+# Vercel's edge replaces X-Forwarded-For with the client address, so IP
+# throttles trust that one entry and nothing a client sends before it
+REST_FRAMEWORK = {**REST_FRAMEWORK, 'NUM_PROXIES': 1}
+
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
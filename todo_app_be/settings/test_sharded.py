@@ -0,0 +1,20 @@
+# Settings for running the test suite against several local task shards:
+#   python manage.py test --settings=todo_app_be.settings.test_sharded
+from .base import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'shard_1.sqlite3',
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'shard_2.sqlite3',
+    },
+}
+
+TASK_SHARDS = ['default', 'shard_1', 'shard_2']
@@ -1,3 +1,300 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .models import RecurringTask, Task
+from .sharding import SHARD_ID_SPAN, get_shards
+
+# Changelist cursor parameters: show rows older or newer than the given id
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+
+    Unfiltered lists on PostgreSQL use the planner's row estimate from
+    `pg_class.reltuples`. Anything else is counted up to `count_limit` rows,
+    which the index-backed filters keep cheap.
+    """
+    count_limit = 10000
+    is_estimate = False
+    is_capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.count_limit:
+                self.is_estimate = True
+                return int(row[0])
+
+        count = queryset.order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit:
+            self.is_capped = True
+            return self.count_limit
+        return count
+
+
+class TaskChangeList(ChangeList):
+    """
+    Changelist that pages by primary key instead of OFFSET.
+
+    Rows are always ordered newest first; `?after=<id>` shows the next page of
+    older tasks and `?before=<id>` the previous page of newer ones, so every
+    page is a single index range scan however deep it is.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # Filter and search links should start again from the first page
+        for cursor in (AFTER_VAR, BEFORE_VAR):
+            self.params.pop(cursor, None)
+            self.filter_params.pop(cursor, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for cursor in (AFTER_VAR, BEFORE_VAR):
+            lookup_params.pop(cursor, None)
+        return lookup_params
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        per_page = self.list_per_page
+
+        try:
+            after = request.GET.get(AFTER_VAR)
+            before = request.GET.get(BEFORE_VAR)
+            after = int(after) if after is not None else None
+            before = int(before) if before is not None else None
+        except ValueError:
+            raise IncorrectLookupParameters
+
+        if before is not None:
+            rows = list(self.queryset.filter(pk__gt=before).order_by('pk')[:per_page + 1])
+            self.has_newer = len(rows) > per_page
+            self.has_older = True
+            rows = rows[:per_page][::-1]
+        else:
+            queryset = self.queryset
+            if after is not None:
+                queryset = queryset.filter(pk__lt=after)
+            rows = list(queryset.order_by('-pk')[:per_page + 1])
+            self.has_older = len(rows) > per_page
+            self.has_newer = after is not None
+            rows = rows[:per_page]
+
+        self.result_count = paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = self.has_older or self.has_newer
+        self.paginator = paginator
+
+    @property
+    def older_url(self):
+        if self.has_older and self.result_list:
+            return self.get_query_string({AFTER_VAR: self.result_list[-1].pk})
+        return None
+
+    @property
+    def newer_url(self):
+        if self.has_newer and self.result_list:
+            return self.get_query_string({BEFORE_VAR: self.result_list[0].pk})
+        return None
+
+
+class UserIdFilter(admin.SimpleListFilter):
+    """
+    Filter by user id typed into a box, instead of listing every user.
+
+    Served by the `(user, ...)` indexes on the task table.
+    """
+    title = 'user id'
+    parameter_name = 'user'
+    template = 'admin/todos/task/user_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            return queryset.filter(user_id=int(value))
+        except ValueError:
+            raise IncorrectLookupParameters
+
+    def choices(self, changelist):
+        yield {
+            'selected': not self.value(),
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'All',
+            'value': self.value() or '',
+            'hidden': [
+                (name, value) for name, value in changelist.params.items()
+                if name != self.parameter_name
+            ],
+        }
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    Choose which task shard the changelist reads; lists cannot span shards.
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        # Checked here because filters without output are never applied
+        if self.value() is not None and self.value() not in get_shards():
+            raise IncorrectLookupParameters
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in get_shards()]
+
+    def has_output(self):
+        return len(get_shards()) > 1
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value() or get_shards()[0])
+
+    def choices(self, changelist):
+        current = self.value() or get_shards()[0]
+        for shard, title in self.lookup_choices:
+            yield {
+                'selected': shard == current,
+                'query_string': changelist.get_query_string({self.parameter_name: shard}),
+                'display': title,
+            }
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Admin for per-user models stored on the task shards (see todos.sharding).
+
+    Lists read one shard at a time through `ShardFilter`; change pages look
+    the object up on the shard its id was allocated on first, then on the
+    others, since moved users keep their ids. Users live on the directory
+    database, so lists show `user_id` rather than joining `auth_user`.
+    """
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(get_shards()[0])
+
+    def get_object(self, request, object_id, from_field=None):
+        queryset = self.get_queryset(request)
+        field = queryset.model._meta.pk if from_field is None else queryset.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except ValidationError:
+            return None
+
+        shards = get_shards()
+        if isinstance(object_id, int) and 0 <= object_id // SHARD_ID_SPAN < len(shards):
+            first = shards[object_id // SHARD_ID_SPAN]
+            shards = [first] + [shard for shard in shards if shard != first]
+        for shard in shards:
+            obj = queryset.using(shard).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                request.task_shard = shard
+                return obj
+        return None
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Related tasks and series live on the same shard as the object
+        if db_field.name != 'user':
+            kwargs.setdefault('using', getattr(request, 'task_shard', None) or get_shards()[0])
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class TaskAdminForm(forms.ModelForm):
+    """
+    Task form that checks a new parent the way TaskSerializer does
+    """
+
+    def clean(self):
+        cleaned_data = super().clean()
+        parent = cleaned_data.get('parent')
+        user = cleaned_data.get('user')
+        task = self.instance
+        if parent is None or 'parent' not in self.changed_data:
+            return cleaned_data
+
+        if user is not None and parent.user_id != user.pk:
+            self.add_error('parent', 'Parent task must belong to the same user.')
+        elif not task._state.adding and (
+            parent.pk == task.pk or parent.path.startswith(task.subtree_path)
+        ):
+            self.add_error('parent', 'A task cannot be moved under itself or one of its subtasks.')
+        elif not task.fits_under(parent):
+            self.add_error('parent', 'Subtasks cannot be nested this deeply.')
+        return cleaned_data
+
+
+@admin.register(Task)
+class TaskAdmin(ShardedModelAdmin):
+    """
+    Admin for the Task table, built to stay fast on very large tables
+    """
+    form = TaskAdminForm
+    list_display = ('id', 'title', 'user_id', 'status', 'priority', 'due_date', 'created_at')
+    list_filter = (ShardFilter, 'status', 'priority', UserIdFilter)
+    search_fields = ('title__startswith',)
+    search_help_text = 'Title prefix (case-sensitive)'
+    raw_id_fields = ('user', 'parent', 'series')
+    list_per_page = 100
+    ordering = ('-id',)
+    sortable_by = ()
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    paginator = EstimatedCountPaginator
+    readonly_fields = ('created_at', 'updated_at')
+
+    def get_changelist(self, request, **kwargs):
+        return TaskChangeList
+
+    def save_model(self, request, obj, form, change):
+        if change and 'parent' in form.changed_data:
+            # Rewrite the subtree's paths along with the new parent
+            with transaction.atomic(using=obj._state.db):
+                obj.move_to(obj.parent)
+                super().save_model(request, obj, form, change)
+            return
+        super().save_model(request, obj, form, change)
+
+    def get_search_results(self, request, queryset, search_term):
+        # The whole query is one prefix, rather than an AND of one prefix per
+        # word, so "Buy milk" finds "Buy milk today" with a single index range
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(title__startswith=search_term), False
+
+
+@admin.register(RecurringTask)
+class RecurringTaskAdmin(ShardedModelAdmin):
+    list_display = ('id', 'title', 'user_id', 'frequency', 'interval', 'starts_at', 'until')
+    list_filter = (ShardFilter, 'frequency')
+    raw_id_fields = ('user',)
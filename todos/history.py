@@ -0,0 +1,152 @@
+"""
+Write-behind buffer for the task change log.
+
+Views call `record()` with the fields a request changed. In 'buffered' mode
+the rows are queued in memory and written with one `bulk_create` when the
+buffer reaches `MAX_BUFFER` rows, when the oldest row is older than
+`FLUSH_INTERVAL` seconds, after the response has been sent
+(`request_finished`) and at interpreter exit. 'sync' mode writes each change
+before the response, and 'off' disables the log. See `TASK_HISTORY` in
+settings.
+
+If a flush fails, its rows are put back at the front of the buffer and
+retried with the next flush, up to `MAX_RETAINED` rows in total; anything
+beyond that is dropped and logged.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError
+
+from .models import TaskChange
+from .sharding import shard_for_user
+
+logger = logging.getLogger(__name__)
+
+# Multiple of MAX_BUFFER kept for retry after failed flushes
+MAX_RETAINED = 10
+
+# Task fields whose changes are logged
+TRACKED_FIELDS = ('title', 'description', 'priority', 'status', 'completed', 'due_date', 'parent_id')
+
+
+def snapshot(task):
+    return {field: getattr(task, field) for field in TRACKED_FIELDS}
+
+
+def diff(before, task):
+    """
+    Return `{field: [old, new]}` for the tracked fields that changed.
+    """
+    return {
+        field: [old, getattr(task, field)]
+        for field, old in before.items()
+        if getattr(task, field) != old
+    }
+
+
+class ChangeBuffer:
+    """
+    Thread-safe, bounded queue of unsaved TaskChange rows, grouped by the
+    database they belong on
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(list)
+        self.size = 0
+        self.oldest = None
+
+    @property
+    def config(self):
+        return settings.TASK_HISTORY
+
+    def add(self, changes, using):
+        with self.lock:
+            if not self.size:
+                self.oldest = time.monotonic()
+            self.pending[using].extend(changes)
+            self.size += len(changes)
+            due = (
+                self.size >= self.config['MAX_BUFFER']
+                or time.monotonic() - self.oldest >= self.config['FLUSH_INTERVAL']
+            )
+        if due:
+            self.flush()
+
+    def flush(self, **kwargs):
+        """
+        Write out everything queued so far.
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending, self.size = defaultdict(list), 0
+        written = 0
+        for using, changes in pending.items():
+            try:
+                TaskChange.objects.using(using).bulk_create(changes, batch_size=self.config['MAX_BUFFER'])
+            except DatabaseError:
+                logger.exception('Could not write %d task changes to %r', len(changes), using)
+                self.requeue(changes, using)
+            else:
+                written += len(changes)
+        return written
+
+    def requeue(self, changes, using):
+        """
+        Put changes from a failed flush back in front of newer ones.
+        """
+        with self.lock:
+            if not self.size:
+                self.oldest = time.monotonic()
+            room = self.config['MAX_BUFFER'] * MAX_RETAINED - self.size
+            if len(changes) > room:
+                logger.error('Dropping %d task changes for %r', len(changes) - max(room, 0), using)
+                changes = changes[len(changes) - max(room, 0):]
+            self.pending[using][:0] = changes
+            self.size += len(changes)
+
+
+buffer = ChangeBuffer()
+request_finished.connect(buffer.flush, dispatch_uid='todos_history_flush')
+atexit.register(buffer.flush)
+
+
+def write(changes, using):
+    """
+    Log TaskChange rows according to the configured mode.
+    """
+    if settings.TASK_HISTORY['MODE'] == 'sync':
+        TaskChange.objects.using(using).bulk_create(changes)
+    else:
+        buffer.add(changes, using)
+
+
+def record(task, user, action, changes):
+    """
+    Log a change to `task` according to the configured mode.
+    """
+    if settings.TASK_HISTORY['MODE'] == 'off' or (action == 'update' and not changes):
+        return
+
+    change = TaskChange(task_id=task.pk, user=user, action=action, changes=changes)
+    write([change], task._state.db or shard_for_user(user))
+
+
+def record_deleted(task, user):
+    """
+    Log the deletion of `task` and of every task in its subtree.
+    """
+    if settings.TASK_HISTORY['MODE'] == 'off':
+        return
+
+    task_ids = [task.pk, *task.descendants().order_by('path', 'id').values_list('pk', flat=True)]
+    write(
+        [TaskChange(task_id=pk, user=user, action='delete', changes={}) for pk in task_ids],
+        task._state.db,
+    )
@@ -0,0 +1,58 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from rest_framework.request import Request
+
+from todos.middleware import ConcurrencyLimitMiddleware
+from todos.models import ThrottleBucket
+from todos.throttling import IPTokenBucketThrottle, UserTokenBucketThrottle
+from todos.views import TaskViewSet
+
+STORES = (
+    ('cache', 'todos.throttling.CacheBucketStore'),
+    ('database', 'todos.throttling.DatabaseBucketStore'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of throttling and the concurrency limiter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        factory = RequestFactory()
+        view = TaskViewSet()
+
+        user = User(pk=1, username='bench')
+        request = Request(factory.get('/api/tasks/'))
+        request.user = user
+        anonymous = Request(factory.get('/api/tasks/'))
+        anonymous.user = AnonymousUser()
+
+        # Rates high enough that every request is admitted
+        rates = {'tasks_user': f'{iterations * 10}/s', 'tasks_ip': f'{iterations * 10}/s'}
+        for label, store in STORES:
+            with override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': rates}, THROTTLE_STORE=store):
+                caches['throttle'].clear()
+                self.report(f'user bucket ({label})', iterations,
+                            lambda: UserTokenBucketThrottle().allow_request(request, view))
+                self.report(f'ip bucket ({label})', iterations,
+                            lambda: IPTokenBucketThrottle().allow_request(anonymous, view))
+        ThrottleBucket.objects.filter(bucket__startswith='bucket_tasks_').delete()
+
+        middleware = ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        plain = factory.get('/api/tasks/')
+        self.report('concurrency limit', iterations, lambda: middleware(plain))
+
+    def report(self, label, iterations, func):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{label:<24} {elapsed / iterations * 1e6:8.2f} us/request')
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from todos import history
+from todos.models import Task
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure how much latency the task change log adds to task updates in each mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        logging.disable(logging.WARNING)
+
+        # Everything runs in one transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                self.run(iterations)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, iterations):
+        user = User.objects.create_user(username='history-bench', password='history-bench')
+        token = Token.objects.create(user=user)
+        task = Task.objects.create(user=user, title='Benchmark')
+
+        client = APIClient(HTTP_HOST='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        url = f'/api/tasks/{task.pk}/'
+
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            for i in range(min(iterations, 100)):
+                client.patch(url, {'title': f'Warm-up {i}'}, format='json')
+        history.buffer.flush()
+
+        # Modes are interleaved in rounds so drift affects them equally
+        modes = ('off', 'sync', 'buffered')
+        rounds = 10
+        per_round = max(1, iterations // rounds)
+        elapsed = dict.fromkeys(modes, 0.0)
+        flushed = dict.fromkeys(modes, 0.0)
+        for _ in range(rounds):
+            for mode in modes:
+                config = {**settings.TASK_HISTORY, 'MODE': mode}
+                with override_settings(REST_FRAMEWORK=rest_framework, TASK_HISTORY=config):
+                    # Time the response path only; buffered rows are written
+                    # after the response, which is timed separately below.
+                    request_finished.disconnect(dispatch_uid='todos_history_flush')
+                    try:
+                        start = time.perf_counter()
+                        for i in range(per_round):
+                            client.patch(url, {'title': f'Benchmark {mode} {i}'}, format='json')
+                        elapsed[mode] += time.perf_counter() - start
+                    finally:
+                        request_finished.connect(history.buffer.flush, dispatch_uid='todos_history_flush')
+
+                    start = time.perf_counter()
+                    history.buffer.flush()
+                    flushed[mode] += time.perf_counter() - start
+
+        total = per_round * rounds
+        results = {
+            mode: (elapsed[mode] / total * 1e6, flushed[mode] / total * 1e6)
+            for mode in modes
+        }
+
+        baseline = results['off'][0]
+        for mode, (latency, flush) in results.items():
+            self.stdout.write(
+                f'{mode:<9} {latency:8.1f} us/update  '
+                f'(+{latency - baseline:6.1f} us, deferred flush {flush:5.1f} us/change)'
+            )
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from todos.sharding import get_directory, get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Run migrate on the directory database and then on every task shard, so "
+        "new shards get their tables and id ranges."
+    )
+
+    def handle(self, *args, **options):
+        directory = get_directory()
+        for using in [directory] + [shard for shard in get_shards() if shard != directory]:
+            self.stdout.write(f'Migrating {using}...')
+            call_command(
+                'migrate', database=using, interactive=False,
+                verbosity=options['verbosity'], stdout=self.stdout, stderr=self.stderr,
+            )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length
+
+from todos.models import Task
+from todos.ordering import REBALANCE_LENGTH
+from todos.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebalance the manual order keys of users whose keys have grown too long. "
+        "Run on a schedule; moves never rebalance in the request unless a key no longer fits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-length', type=int, default=REBALANCE_LENGTH)
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Rebalance this user regardless of key length (repeatable)')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = sorted({
+                user_id
+                for using in get_shards()
+                for user_id in Task.objects.using(using)
+                .annotate(position_length=Length('position'))
+                .filter(position_length__gt=options['max_length'])
+                .order_by()
+                .values_list('user_id', flat=True)
+                .distinct()
+            })
+
+        for user_id in user_ids:
+            Task.rebalance_positions(user_id)
+        self.stdout.write(f'Rebalanced positions for {len(user_ids)} user(s).')
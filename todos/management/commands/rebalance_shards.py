@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from todos.models import RecurringTask, Task, TaskChange, TaskOrderLock, UserShard
+from todos.sharding import get_directory, get_shards, ring_shard
+
+# Copied in this order so rows they reference already exist
+MODELS = (RecurringTask, Task, TaskChange, TaskOrderLock)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users whose task data is not on the shard the hash ring assigns them, "
+        "e.g. after appending a database to TASK_SHARDS. Safe to re-run after an "
+        "interruption; users being moved should not be editing tasks meanwhile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report which users would move')
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only consider this user (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        shards = get_shards()
+        directory = get_directory()
+
+        users = User.objects.using(directory).order_by('pk')
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+
+        moved = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            pin = UserShard.objects.using(directory).filter(user_id=user_id).first()
+            if pin is not None and pin.previous:
+                # A previous run switched this user over but did not finish
+                # cleaning up the old shard
+                if not options['dry_run']:
+                    self.delete_rows(user_id, pin.previous)
+                    pin.previous = None
+                    pin.save(using=directory, update_fields=['previous'])
+
+            source = pin.shard if pin is not None else shards[0]
+            target = ring_shard(user_id)
+            if source == target:
+                if pin is None and len(shards) > 1 and not options['dry_run']:
+                    UserShard.objects.using(directory).create(user_id=user_id, shard=source)
+                continue
+
+            if shards.index(target) < shards.index(source) and (
+                connections[target].vendor != 'postgresql'
+            ):
+                # Explicit ids above the target's range would advance its
+                # id counter into the next shard's range
+                self.stderr.write(
+                    f'Skipping user {user_id}: cannot move from {source} to the older shard {target}.'
+                )
+                continue
+
+            self.stdout.write(f'User {user_id}: {source} -> {target}')
+            if not options['dry_run']:
+                self.move(user_id, pin, source, target, options['batch_size'])
+            moved += 1
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(f'{verb} {moved} user(s).')
+
+    def move(self, user_id, pin, source, target, batch_size):
+        directory = get_directory()
+
+        # Copy everything, replacing whatever an interrupted run left behind
+        with transaction.atomic(using=target):
+            self.delete_rows(user_id, target)
+            for model in MODELS:
+                rows = model.objects.using(source).filter(user_id=user_id).order_by('pk')
+                model.objects.using(target).bulk_create(
+                    rows.iterator(chunk_size=batch_size), batch_size=batch_size
+                )
+
+        # Switch the user over, remembering the old shard until it is emptied
+        if pin is None:
+            pin = UserShard(user_id=user_id)
+        pin.shard, pin.previous = target, source
+        pin.save(using=directory)
+
+        self.delete_rows(user_id, source)
+        pin.previous = None
+        pin.save(using=directory, update_fields=['previous'])
+
+    def delete_rows(self, user_id, using):
+        with transaction.atomic(using=using):
+            for model in reversed(MODELS):
+                model.objects.using(using).filter(user_id=user_id).delete()
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 15:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode_position(number):
+    digits = ''
+    while True:
+        number, remainder = divmod(number, len(DIGITS))
+        digits = DIGITS[remainder] + digits
+        if not number:
+            break
+    return chr(ord('a') + len(digits) - 1) + digits
+
+
+def backfill_positions(apps, schema_editor):
+    """
+    Seed each user's manual order from the default task ordering
+    """
+    Task = apps.get_model('todos', 'Task')
+    user_ids = list(Task.objects.order_by().values_list('user_id', flat=True).distinct())
+    for user_id in user_ids:
+        tasks = list(
+            Task.objects.filter(user_id=user_id)
+            .order_by('due_date', 'priority', '-created_at')
+            .only('id')
+        )
+        for number, task in enumerate(tasks, start=1):
+            task.position = encode_position(number)
+        Task.objects.bulk_update(tasks, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todos', '0003_task_admin_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='position',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_positions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'position'], name='task_user_position_idx'),
+        ),
+    ]
@@ -1,5 +1,39 @@
+import calendar
+from datetime import timedelta
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MinValueValidator
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import CharField, F, Max, Value
+from django.db.models.functions import Concat, Length, Substr
+from django.utils import timezone
+
+from .ordering import key_between, sequential_keys
+from .sharding import shard_for_user
+
+
+class UserQuerySet(models.QuerySet):
+    """
+    QuerySet for per-user models stored on the user's shard
+    """
+
+    def for_user(self, user):
+        """
+        Return the user's rows, read from the shard that holds them.
+        """
+        return self.using(shard_for_user(user)).filter(user=user)
+
+    def create(self, **kwargs):
+        """
+        Create a row on its user's shard unless a database was chosen with
+        `using()`.
+        """
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
 
 # Create your models here.
 class Task(models.Model):
@@ -24,10 +58,321 @@ class Task(models.Model):
     due_date = models.DateTimeField(blank=True, null=True)
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='pending')
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tasks')
+    # Users may live on another database, so there is no constraint and
+    # deleting a user is cascaded by todos.signals instead
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='tasks', db_constraint=False)
+    # Manual sort key, see todos.ordering
+    position = models.CharField(max_length=255, blank=True, default='')
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, related_name='children', blank=True, null=True
+    )
+    # Materialized path of ancestor ids, root first, e.g. '12/45/' ('' for top-level tasks).
+    # Its length bounds nesting depth: about 70 levels with 13-digit shard ids.
+    path = models.CharField(max_length=1000, blank=True, default='', editable=False)
+    # Set when this task overrides one occurrence of a recurring series
+    series = models.ForeignKey(
+        'RecurringTask', on_delete=models.SET_NULL, related_name='overrides', blank=True, null=True
+    )
+    occurrence = models.DateTimeField(blank=True, null=True)
+
+    objects = UserQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    @property
+    def depth(self):
+        return self.path.count('/')
+
+    @property
+    def subtree_path(self):
+        """
+        Path prefix shared by every descendant of this task
+        """
+        return f'{self.path}{self.pk}/'
+
+    @property
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    def descendants(self):
+        return Task.objects.using(self._state.db).filter(
+            user_id=self.user_id, path__startswith=self.subtree_path
+        )
+
+    def fits_under(self, parent):
+        """
+        Whether every path in this task's subtree stays within the path
+        column if the task is moved under `parent` (or created there).
+        """
+        new_path = parent.subtree_path if parent is not None else ''
+        longest = len(new_path)
+        if not self._state.adding:
+            deepest = self.descendants().aggregate(longest=Max(Length('path')))['longest']
+            if deepest is not None:
+                longest = deepest - len(self.path) + len(new_path)
+        return longest <= Task._meta.get_field('path').max_length
+
+    def move_to(self, parent):
+        """
+        Re-parent this task, rewriting the paths of its whole subtree in a
+        single UPDATE.
+        """
+        old_prefix = self.subtree_path
+        if parent is not None and (parent.pk == self.pk or parent.path.startswith(old_prefix)):
+            raise ValueError('A task cannot be moved under itself or one of its subtasks.')
+        if not self.fits_under(parent):
+            raise ValueError('Subtasks cannot be nested this deeply.')
+
+        new_path = parent.subtree_path if parent is not None else ''
+        with transaction.atomic(using=self._state.db):
+            self.descendants().update(path=Concat(
+                Value(f'{new_path}{self.pk}/'),
+                Substr('path', len(old_prefix) + 1),
+                output_field=CharField()
+            ))
+            self.parent = parent
+            self.path = new_path
+            self.save(update_fields=['parent', 'path', 'updated_at'])
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id and not self.path:
+            self.path = self.parent.subtree_path
+        # New tasks go to the end of the user's manual order. The order lock
+        # keeps a concurrent rebalance from rewriting the last key before
+        # this one is placed after it, which would land the task mid-list.
+        if self._state.adding and not self.position:
+            using = kwargs.get('using') or router.db_for_write(Task, instance=self)
+            with transaction.atomic(using=using):
+                TaskOrderLock.acquire(self.user_id, using)
+                last = (
+                    Task.objects.using(using).filter(user_id=self.user_id)
+                    .order_by('-position')
+                    .values_list('position', flat=True)
+                    .first()
+                )
+                self.position = key_between(last or None, None)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def rebalance_positions(cls, user_id, batch_size=1000):
+        """
+        Rewrite a user's position keys as short, evenly spaced keys,
+        preserving their current manual order.
+        """
+        using = shard_for_user(user_id)
+        with transaction.atomic(using=using):
+            TaskOrderLock.acquire(user_id, using)
+            tasks = list(
+                cls.objects.using(using)
+                .filter(user_id=user_id)
+                .order_by('position', 'id')
+                .only('id', 'position')
+            )
+            for task, position in zip(tasks, sequential_keys(len(tasks))):
+                task.position = position
+            cls.objects.using(using).bulk_update(tasks, ['position'], batch_size=batch_size)
+
     class Meta:
         ordering = ['due_date', 'priority', '-created_at']
+        indexes = [
+            # Admin status/priority filters, newest first
+            models.Index(fields=['status', '-id'], name='task_status_id_idx'),
+            models.Index(fields=['priority', '-id'], name='task_priority_id_idx'),
+            # Title prefix search (LIKE 'abc%') on PostgreSQL
+            models.Index(fields=['title'], name='task_title_prefix_idx', opclasses=['varchar_pattern_ops']),
+            # Manual order
+            models.Index(fields=['user', 'position'], name='task_user_position_idx'),
+            # Subtree lookups (LIKE '12/45/%')
+            models.Index(fields=['path'], name='task_path_prefix_idx', opclasses=['varchar_pattern_ops']),
+            # Agenda listing by due date
+            models.Index(fields=['user', 'due_date', 'id'], name='task_user_due_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'occurrence'], name='unique_series_occurrence'),
+        ]
+
+
+class TaskOrderLock(models.Model):
+    """
+    Per-user row that serializes changes to a user's manual order.
+
+    Moves, appends and rebalances all read neighbouring keys before writing,
+    so they must not interleave: a move computed from keys that a rebalance
+    has since rewritten would land in the wrong place.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.DO_NOTHING, primary_key=True, related_name='+', db_constraint=False
+    )
+    version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def acquire(cls, user_id, using):
+        """
+        Lock the user's order until the current transaction ends.
+
+        The lock is taken with an UPDATE rather than SELECT ... FOR UPDATE so
+        that it also serializes on SQLite.
+        """
+        locks = cls.objects.using(using).filter(user_id=user_id)
+        if locks.update(version=F('version') + 1):
+            return
+        try:
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(user_id=user_id)
+        except IntegrityError:
+            # Created concurrently; wait for it like any other holder
+            locks.update(version=F('version') + 1)
+
+
+class RecurringTask(models.Model):
+    """
+    A repeating task, stored once per series.
+
+    Occurrences are generated on demand by `occurrences()`; only the ones a
+    user changes are saved, as `Task` rows pointing back at the series.
+    """
+    FREQUENCY_CHOICES = (
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+    )
+
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True, null=True)
+    priority = models.CharField(max_length=10, choices=Task.PRIORITY_CHOICES, default='medium')
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default='daily')
+    interval = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    starts_at = models.DateTimeField()
+    until = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, related_name='recurring_tasks', db_constraint=False
+    )
+
+    objects = UserQuerySet.as_manager()
+
+    def __str__(self):
+        return self.title
+
+    def _nth(self, n):
+        """
+        Return the n-th occurrence (0-based), ignoring `until`.
+        """
+        if self.frequency == 'monthly':
+            month = self.starts_at.month - 1 + n * self.interval
+            year = self.starts_at.year + month // 12
+            month = month % 12 + 1
+            day = min(self.starts_at.day, calendar.monthrange(year, month)[1])
+            return self.starts_at.replace(year=year, month=month, day=day)
+        return self.starts_at + self._step() * n
+
+    def _step(self):
+        return timedelta(days=self.interval * (7 if self.frequency == 'weekly' else 1))
+
+    def occurrences(self, start=None, end=None):
+        """
+        Lazily yield occurrence datetimes in `[start, end)`.
+
+        The first occurrence at or after `start` is computed directly, so the
+        cost does not depend on how long the series has been running.
+        """
+        n = 0
+        try:
+            if start is not None and start > self.starts_at:
+                if self.frequency == 'monthly':
+                    n = max(0, ((start.year - self.starts_at.year) * 12
+                                + start.month - self.starts_at.month) // self.interval - 1)
+                else:
+                    n = (start - self.starts_at) // self._step()
+                while self._nth(n) < start:
+                    n += 1
+
+            while True:
+                when = self._nth(n)
+                if (self.until is not None and when > self.until) or (end is not None and when >= end):
+                    return
+                yield when
+                n += 1
+        except (OverflowError, ValueError):
+            # Past the largest representable date
+            return
+
+    def is_occurrence(self, when):
+        return next(self.occurrences(start=when), None) == when
+
+    def build_occurrence(self, when):
+        """
+        Return an unsaved Task for the occurrence at `when`
+        """
+        return Task(
+            user_id=self.user_id,
+            title=self.title,
+            description=self.description,
+            priority=self.priority,
+            due_date=when,
+            series=self,
+            occurrence=when,
+        )
+
+
+class TaskChange(models.Model):
+    """
+    Append-only log entry for one change to a task.
+
+    Only the fields that changed are kept, as `{field: [old, new]}`. The
+    task is referenced by id alone so its history outlives it.
+    """
+    ACTION_CHOICES = (
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    )
+
+    task_id = models.BigIntegerField()
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, related_name='task_changes', db_constraint=False
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = UserQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.action} task {self.task_id}'
+
+    class Meta:
+        ordering = ['task_id', 'id']
+        indexes = [
+            models.Index(fields=['task_id', 'id'], name='taskchange_task_idx'),
+        ]
+
+
+class UserShard(models.Model):
+    """
+    Directory entry recording which shard holds a user's tasks.
+
+    `previous` is set while the user's rows are being moved off that shard.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='task_shard')
+    shard = models.CharField(max_length=100)
+    previous = models.CharField(max_length=100, blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.user_id} on {self.shard}'
+
+
+class ThrottleBucket(models.Model):
+    """
+    API rate limit bucket used by `todos.throttling.DatabaseBucketStore`.
+
+    `tat` is the time (epoch seconds) at which the bucket is full again.
+    """
+    bucket = models.CharField(max_length=255, primary_key=True)
+    tat = models.FloatField()
+
+    def __str__(self):
+        return self.bucket
@@ -0,0 +1,127 @@
+"""
+Lexicographic position keys for manually ordered task lists.
+
+A key is an integer part followed by an optional fraction, written in
+lowercase base 36 so that plain string comparison matches numeric order under
+any database collation. The first character gives the sign and number of
+integer digits: 'a' = 1, 'b' = 2, ... for zero and up, and '9' = 1, '8' = 2,
+... for negative integers, whose digits count up from -36**n. Keys added at
+either end of a list step the integer, so they grow by one character per
+factor of 36 tasks, and a key can always be found strictly between two others
+by bisecting the fraction. Moving a task therefore only ever rewrites that
+task's key.
+"""
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+# Keys longer than this are worth rebalancing
+REBALANCE_LENGTH = 32
+
+
+# Longest integer parts, in digits, for zero and up and for negative integers
+MAX_DIGITS = 26
+MAX_NEGATIVE_DIGITS = 10
+
+
+def _digits(number, size=1):
+    digits = ''
+    while number or len(digits) < size:
+        number, remainder = divmod(number, BASE)
+        digits = DIGITS[remainder] + digits
+    return digits
+
+
+def _encode_integer(number):
+    if number >= 0:
+        digits = _digits(number)
+        if len(digits) > MAX_DIGITS:
+            raise ValueError('Position key integer part is out of range.')
+        return chr(ord('a') + len(digits) - 1) + digits
+
+    # -1 is '9z' and -36 is '90'; wider negatives sort before narrower ones
+    size = 1
+    while BASE ** size < -number:
+        size += 1
+    if size > MAX_NEGATIVE_DIGITS:
+        raise ValueError('Position key integer part is out of range.')
+    return DIGITS[MAX_NEGATIVE_DIGITS - size] + _digits(BASE ** size + number, size)
+
+
+def _integer_size(head):
+    if head.isdigit():
+        return MAX_NEGATIVE_DIGITS - DIGITS.index(head)
+    return ord(head) - ord('a') + 1
+
+
+def _decode_integer(integer):
+    number = 0
+    for digit in integer[1:]:
+        number = number * BASE + DIGITS.index(digit)
+    if integer[0].isdigit():
+        return number - BASE ** (len(integer) - 1)
+    return number
+
+
+def _split(key):
+    size = _integer_size(key[0]) + 1
+    return key[:size], key[size:]
+
+
+def _midpoint(lower, upper):
+    """
+    Return a fraction strictly between `lower` and `upper` (None = 1).
+
+    Fractions never end in '0', so there is always room below them.
+    """
+    if upper is not None:
+        # Keep the common prefix and bisect the remainder
+        n = 0
+        while n < len(upper) and (lower[n] if n < len(lower) else '0') == upper[n]:
+            n += 1
+        if n:
+            return upper[:n] + _midpoint(lower[n:], upper[n:])
+
+    low = DIGITS.index(lower[0]) if lower else 0
+    high = DIGITS.index(upper[0]) if upper is not None else BASE
+    if high - low > 1:
+        return DIGITS[(low + high) // 2]
+    if upper is not None and len(upper) > 1:
+        return upper[0]
+    return DIGITS[low] + _midpoint(lower[1:], None)
+
+
+def key_between(lower, upper):
+    """
+    Return a key that sorts strictly between `lower` and `upper`.
+
+    Either bound may be None for the start or end of the list. Raises
+    ValueError if `lower` does not sort before `upper`.
+    """
+    if lower is not None and upper is not None and lower >= upper:
+        raise ValueError(f'Position key {lower!r} must sort before {upper!r}.')
+
+    if lower is None and upper is None:
+        return _encode_integer(1)
+
+    if lower is None:
+        integer, _ = _split(upper)
+        return _encode_integer(_decode_integer(integer) - 1)
+
+    integer, fraction = _split(lower)
+    if upper is not None:
+        upper_integer, upper_fraction = _split(upper)
+        if integer == upper_integer:
+            return integer + _midpoint(fraction, upper_fraction)
+
+    following = _encode_integer(_decode_integer(integer) + 1)
+    if upper is None or following < upper:
+        return following
+    return integer + _midpoint(fraction, None)
+
+
+def sequential_keys(count):
+    """
+    Return `count` short, evenly spaced keys in ascending order.
+    """
+    return [_encode_integer(number) for number in range(1, count + 1)]
@@ -0,0 +1,110 @@
+"""
+Agenda listing that merges concrete tasks with recurring occurrences.
+
+Every source is a lazy stream sorted by due date: the user's tasks come from
+a chunked database cursor and each series from `RecurringTask.occurrences()`.
+`heapq.merge` interleaves them, so producing a page only generates the
+entries up to the end of that page, however long the series run.
+"""
+import heapq
+from datetime import datetime
+from itertools import dropwhile
+
+from django.db.models import Q
+
+from .models import RecurringTask, Task
+
+CONCRETE, VIRTUAL = 0, 1
+
+
+def encode_cursor(key):
+    when, kind, pk = key
+    return f'{when.isoformat()},{kind},{pk}'
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor from `encode_cursor`. Raises ValueError if malformed,
+    naive or out of range.
+    """
+    when, kind, pk = cursor.rsplit(',', 2)
+    when, kind, pk = datetime.fromisoformat(when), int(kind), int(pk)
+    if when.utcoffset() is None or kind not in (CONCRETE, VIRTUAL) or pk < 1:
+        raise ValueError(f'Invalid cursor {cursor!r}.')
+    return when, kind, pk
+
+
+def unchanged_occurrences(series, start, end=None):
+    """
+    Yield `(when, series)` for every occurrence in `[start, end)` that has no
+    override row, in time order.
+    """
+    if not series:
+        return
+    streams = [
+        ((when, item) for when in item.occurrences(start, end))
+        for item in series
+    ]
+    merged = heapq.merge(*streams, key=lambda entry: (entry[0], entry[1].pk))
+
+    # Overrides are read in the same order and skipped in step with the merge
+    overrides = Task.objects.using(series[0]._state.db).filter(
+        series__in=series, occurrence__gte=start
+    )
+    if end is not None:
+        overrides = overrides.filter(occurrence__lt=end)
+    overrides = (
+        overrides.order_by('occurrence')
+        .values_list('occurrence', 'series_id')
+        .iterator(chunk_size=500)
+    )
+
+    override = next(overrides, None)
+    current, changed = None, set()
+    for when, item in merged:
+        if when != current:
+            current, changed = when, set()
+            while override is not None and override[0] < when:
+                override = next(overrides, None)
+            while override is not None and override[0] == when:
+                changed.add(override[1])
+                override = next(overrides, None)
+        if item.pk not in changed:
+            yield when, item
+
+
+def agenda(user, start, end=None, status=None, after=None):
+    """
+    Yield `(key, task)` for the user's agenda from `start`, ordered by key.
+
+    Concrete tasks (including saved overrides) are yielded as they are;
+    unchanged occurrences are yielded as unsaved `Task` instances built by
+    `RecurringTask.build_occurrence()`. `after` is a key from a previous page.
+    """
+    if after is not None:
+        start = max(start, after[0])
+
+    tasks = Task.objects.for_user(user).filter(due_date__gte=start)
+    if end is not None:
+        tasks = tasks.filter(due_date__lt=end)
+    if status:
+        tasks = tasks.filter(status=status)
+    tasks = tasks.order_by('due_date', 'id').iterator(chunk_size=100)
+    streams = [(((task.due_date, CONCRETE, task.pk), task) for task in tasks)]
+
+    # Unchanged occurrences are always pending
+    if not status or status == 'pending':
+        series = RecurringTask.objects.for_user(user).filter(
+            Q(until__isnull=True) | Q(until__gte=start)
+        )
+        if end is not None:
+            series = series.filter(starts_at__lt=end)
+        streams.append(
+            ((when, VIRTUAL, item.pk), item.build_occurrence(when))
+            for when, item in unchanged_occurrences(list(series), start, end)
+        )
+
+    entries = heapq.merge(*streams, key=lambda entry: entry[0])
+    if after is not None:
+        entries = dropwhile(lambda entry: entry[0] <= after, entries)
+    return entries
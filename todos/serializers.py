@@ -1,19 +1,59 @@
+from collections import defaultdict
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.db import router, transaction
 from rest_framework.authtoken.models import Token
-from .models import Task
+from .models import RecurringTask, Task, TaskChange
+from .recurrence import decode_cursor
+from .sharding import shard_for_user
 
 
 class TaskSerializer(serializers.ModelSerializer):
     """
     Serializer for Task model
     """
+    depth = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Task
-        fields = ['id', 'title', 'description', 'priority', 'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = [
+            'id', 'title', 'description', 'priority', 'status', 'due_date', 'position',
+            'parent', 'depth', 'series', 'occurrence', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'position', 'series', 'occurrence', 'created_at', 'updated_at']
+
+    def get_fields(self):
+        """
+        Look up parent tasks on the current user's shard
+        """
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            fields['parent'].queryset = Task.objects.using(shard_for_user(request.user))
+        return fields
+
+    def validate_parent(self, parent):
+        """
+        Check that the parent belongs to the current user and is not
+        inside the task's own subtree
+        """
+        if parent is None:
+            return parent
+        if parent.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError('Parent task not found.')
+        # Unsaved instances (new occurrence overrides) have no subtree yet
+        task = self.instance if self.instance is not None else Task()
+        if not task._state.adding and (
+            parent.pk == task.pk or parent.path.startswith(task.subtree_path)
+        ):
+            raise serializers.ValidationError(
+                'A task cannot be moved under itself or one of its subtasks.'
+            )
+        if not task.fits_under(parent):
+            raise serializers.ValidationError('Subtasks cannot be nested this deeply.')
+        return parent
 
     def create(self, validated_data):
         """
@@ -23,6 +63,119 @@ class TaskSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         return Task.objects.create(user=user, **validated_data)
 
+    def update(self, instance, validated_data):
+        """
+        Update a task, moving its subtree if the parent changed.
+
+        Unsaved instances, such as a new override built by
+        `RecurringTask.build_occurrence`, are saved once with their parent.
+        """
+        using = instance._state.db or router.db_for_write(Task, instance=instance)
+        with transaction.atomic(using=using):
+            if 'parent' in validated_data and not instance._state.adding:
+                parent = validated_data.pop('parent')
+                if parent != instance.parent:
+                    instance.move_to(parent)
+            return super().update(instance, validated_data)
+
+
+class TaskTreeSerializer(TaskSerializer):
+    """
+    Serializer for a task and its nested subtasks.
+
+    Expects the whole subtree in `context['subtree']` as returned by
+    `Task.descendants()`, and assembles the nesting and completion roll-ups
+    in a single pass over it.
+    """
+
+    def to_representation(self, instance):
+        nodes = TaskSerializer(
+            [instance, *self.context['subtree']], many=True, context=self.context
+        ).data
+
+        by_id = {}
+        levels = defaultdict(list)
+        for node in nodes:
+            node['children'] = []
+            node['subtask_count'] = 0
+            node['completed_subtask_count'] = 0
+            by_id[node['id']] = node
+            levels[node['depth']].append(node)
+
+        # Attach children deepest level first so roll-ups flow up in one pass
+        root = nodes[0]
+        for depth in sorted(levels, reverse=True):
+            if depth <= root['depth']:
+                break
+            for node in levels[depth]:
+                parent = by_id[node['parent']]
+                parent['children'].append(node)
+                parent['subtask_count'] += 1 + node['subtask_count']
+                parent['completed_subtask_count'] += (
+                    node['completed_subtask_count'] + (node['status'] == 'completed')
+                )
+        return root
+
+
+class TaskChangeSerializer(serializers.ModelSerializer):
+    """
+    Serializer for TaskChange model
+    """
+
+    class Meta:
+        model = TaskChange
+        fields = ['id', 'task_id', 'action', 'changes', 'created_at']
+        read_only_fields = fields
+
+
+class RecurringTaskSerializer(serializers.ModelSerializer):
+    """
+    Serializer for RecurringTask model
+    """
+
+    class Meta:
+        model = RecurringTask
+        fields = [
+            'id', 'title', 'description', 'priority', 'frequency', 'interval',
+            'starts_at', 'until', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate(self, attrs):
+        """
+        Validate that the series does not end before it starts
+        """
+        starts_at = attrs.get('starts_at', getattr(self.instance, 'starts_at', None))
+        until = attrs.get('until', getattr(self.instance, 'until', None))
+        if until is not None and until < starts_at:
+            raise serializers.ValidationError({"until": "Must not be before starts_at."})
+        return attrs
+
+    def create(self, validated_data):
+        """
+        Create a new series for the current user
+        """
+        user = self.context['request'].user
+        return RecurringTask.objects.create(user=user, **validated_data)
+
+
+class AgendaQuerySerializer(serializers.Serializer):
+    """
+    Query parameters for the task agenda listing
+    """
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField(required=False)
+    status = serializers.ChoiceField(choices=Task.STATUS_CHOICES, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=50)
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, cursor):
+        try:
+            return decode_cursor(cursor)
+        except ValueError:
+            raise serializers.ValidationError('Invalid cursor.')
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """
     Serializer for user registration
@@ -0,0 +1,188 @@
+"""
+Horizontal sharding of task data by user.
+
+`auth`, `authtoken` and the other shared tables live on the directory
+database (`TASK_DIRECTORY_DB`). Everything in this app that belongs to a user
+(tasks, recurring tasks, change log) lives on one of the `TASK_SHARDS`
+databases, chosen per user:
+
+- a user's shard is recorded in the directory's `UserShard` table when the
+  user is created, using a consistent-hash ring over `TASK_SHARDS`;
+- users without a `UserShard` row (created before sharding was enabled) are
+  on the first shard;
+- `manage.py rebalance_shards` moves users whose shard no longer matches the
+  ring, e.g. after a shard is added.
+
+Each shard allocates ids from its own range (`SHARD_ID_SPAN` apart), so ids
+stay unique across shards and users can be moved without renumbering.
+`TASK_SHARDS` must only ever be appended to.
+
+Django routers never see query filters, so views must select the shard with
+`.using()`, normally through `Task.objects.for_user(user)`. Saves and related
+lookups are routed automatically from the instance's `user_id`.
+"""
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import migrations
+
+# Ids allocated by the n-th shard start at n * SHARD_ID_SPAN (kept well
+# below 2**53 so they survive JSON parsing in JavaScript clients)
+SHARD_ID_SPAN = 2 ** 40
+
+# Virtual nodes per shard on the hash ring
+RING_REPLICAS = 64
+
+SHARDED_MODELS = ('task', 'taskorderlock', 'recurringtask', 'taskchange')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping user ids to shard aliases.
+
+    Adding a shard only moves the users whose ring segment it takes over,
+    roughly 1/N of them.
+    """
+
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        points = sorted(
+            (_hash(f'{shard}#{replica}'), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        self.keys = [key for key, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def get_shard(self, user_id):
+        index = bisect.bisect(self.keys, _hash(str(user_id))) % len(self.keys)
+        return self.shards[index]
+
+
+@lru_cache(maxsize=None)
+def get_ring(shards):
+    return HashRing(shards)
+
+
+def get_shards():
+    return list(settings.TASK_SHARDS)
+
+
+def get_directory():
+    return settings.TASK_DIRECTORY_DB
+
+
+def ring_shard(user_id):
+    """
+    Shard the ring assigns to `user_id`.
+    """
+    return get_ring(tuple(settings.TASK_SHARDS)).get_shard(user_id)
+
+
+def shard_for_user(user):
+    """
+    Return the alias of the database holding `user`'s tasks.
+
+    Accepts a user or a user id; the result is memoized on user instances.
+    """
+    shards = settings.TASK_SHARDS
+    if len(shards) == 1:
+        return shards[0]
+
+    shard = getattr(user, '_task_shard', None)
+    if shard is not None:
+        return shard
+
+    from .models import UserShard
+
+    user_id = getattr(user, 'pk', user)
+    shard = (
+        UserShard.objects.using(get_directory())
+        .filter(user_id=user_id)
+        .values_list('shard', flat=True)
+        .first()
+    ) or shards[0]
+    if hasattr(user, 'pk'):
+        user._task_shard = shard
+    return shard
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'todos' and model._meta.model_name in SHARDED_MODELS
+
+
+class UserShardRouter:
+    """
+    Route this app's per-user models to the user's shard and everything
+    else to the directory database.
+    """
+
+    def _shard_for_hints(self, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if is_sharded(type(instance)):
+            if instance._state.db:
+                return instance._state.db
+            user_id = instance.user_id
+        elif instance._meta.label == settings.AUTH_USER_MODEL:
+            user_id = instance.pk
+        else:
+            return None
+        return shard_for_user(user_id) if user_id is not None else None
+
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self._shard_for_hints(hints)
+        return get_directory()
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            return self._shard_for_hints(hints)
+        return get_directory()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Task data may point at a user on the directory database
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'todos' and model_name in SHARDED_MODELS:
+            return db in settings.TASK_SHARDS
+        if app_label == 'todos' and model_name is None:
+            # Data migrations without hints work on task data
+            return db in settings.TASK_SHARDS
+        return db == get_directory()
+
+
+class CreateShardedModel(migrations.CreateModel):
+    """
+    CreateModel that leaves out the constraints on foreign keys to the user
+    model except on the directory database, the only one with a user table.
+
+    Used by the migrations that created per-user models before their user
+    keys were made unconstrained, so that they also apply to empty shards.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.name)
+        user_keys = []
+        if schema_editor.connection.alias != get_directory():
+            user_keys = [
+                field for field in model._meta.local_fields
+                if field.is_relation and field.db_constraint
+                and field.related_model._meta.label == settings.AUTH_USER_MODEL
+            ]
+        for field in user_keys:
+            field.db_constraint = False
+        try:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        finally:
+            for field in user_keys:
+                field.db_constraint = True
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import RecurringTask, Task, TaskChange, TaskOrderLock, UserShard
+from .sharding import SHARD_ID_SPAN, get_directory, ring_shard, shard_for_user
+
+
+@receiver(post_save, sender=User)
+def pin_user_shard(sender, instance, created, raw=False, **kwargs):
+    """
+    Place new users on the shard the hash ring assigns them.
+    """
+    if created and not raw and len(settings.TASK_SHARDS) > 1:
+        shard = ring_shard(instance.pk)
+        UserShard.objects.using(get_directory()).create(user=instance, shard=shard)
+        instance._task_shard = shard
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_tasks(sender, instance, **kwargs):
+    """
+    Delete the user's rows on their shard; there is no cross-database cascade.
+    """
+    using = shard_for_user(instance)
+    TaskChange.objects.using(using).filter(user_id=instance.pk).delete()
+    Task.objects.using(using).filter(user_id=instance.pk).delete()
+    RecurringTask.objects.using(using).filter(user_id=instance.pk).delete()
+    TaskOrderLock.objects.using(using).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_migrate)
+def start_shard_id_ranges(sender, using, **kwargs):
+    """
+    Make the n-th shard allocate ids from n * SHARD_ID_SPAN upwards.
+    """
+    if sender.name != 'todos' or using not in settings.TASK_SHARDS:
+        return
+    base = settings.TASK_SHARDS.index(using) * SHARD_ID_SPAN
+    if not base:
+        return
+
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in (Task, RecurringTask, TaskChange):
+            table = model._meta.db_table
+            if model.objects.using(using).filter(pk__gte=base).exists():
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT setval(pg_get_serial_sequence(%s, %s), %s, false)',
+                    [table, 'id', base],
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, base - 1]
+                )
+            elif connection.vendor == 'mysql':
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table)} AUTO_INCREMENT = {base}')
@@ -1,13 +1,54 @@
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import islice
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.management import call_command
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DatabaseError, connection, connections
+from django.db.models import QuerySet
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
-from .models import Task
+from . import history as change_log
+from .admin import EstimatedCountPaginator, TaskAdmin
+from .middleware import ConcurrencyLimitMiddleware
+from .management.commands.rebalance_shards import Command as RebalanceShardsCommand
+from .models import RecurringTask, Task, TaskChange, UserShard
+from .ordering import key_between
+from .throttling import CacheBucketStore, DatabaseBucketStore
+from .sharding import SHARD_ID_SPAN, HashRing, ring_shard, shard_for_user
+
+# Requests look their user's shard up on the directory once there are several
+SHARD_LOOKUPS = int(len(settings.TASK_SHARDS) > 1)
+
+
+@contextmanager
+def capture_all_queries():
+    """
+    Capture the queries run on every database, since tasks live on the user's
+    shard while users and tokens stay on the directory.
+    """
+    queries = []
+    with ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        yield queries
+    for context in contexts:
+        queries.extend(context.captured_queries)
 
 
 class TaskAPITests(APITestCase):
+    databases = '__all__'
+
     def setUp(self):
+        caches['throttle'].clear()
+
         # Create test users
         self.user1 = User.objects.create_user(
             username='testuser1',
@@ -63,16 +104,16 @@ class TaskAPITests(APITestCase):
         response = self.client1.post(self.list_create_url, new_task_data, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(Task.objects.count(), 3)
+        self.assertEqual(Task.objects.for_user(self.user1).count(), 3)
 
         # Verify the task is associated with the correct user
-        created_task = Task.objects.get(title='New Test Task')
+        created_task = Task.objects.for_user(self.user1).get(title='New Test Task')
         self.assertEqual(created_task.user, self.user1)
 
     def test_delete_own_task(self):
         """Test deleting own task"""
         # Verify task exists before deletion
-        self.assertTrue(Task.objects.filter(pk=self.task1.pk).exists())
+        self.assertTrue(Task.objects.for_user(self.user1).filter(pk=self.task1.pk).exists())
 
         response = self.client1.delete(self.detail_url)
 
@@ -81,10 +122,10 @@ class TaskAPITests(APITestCase):
 
         # Verify the task is deleted
         with self.assertRaises(Task.DoesNotExist):
-            Task.objects.get(pk=self.task1.pk)
+            Task.objects.for_user(self.user1).get(pk=self.task1.pk)
 
         # Verify only one task remains for the user
-        self.assertEqual(Task.objects.filter(user=self.user1).count(), 1)
+        self.assertEqual(Task.objects.for_user(self.user1).count(), 1)
 
     def test_list_tasks(self):
         """Test retrieving list of tasks"""
@@ -110,7 +151,7 @@ class TaskAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Refresh task and verify updates
-        updated_task = Task.objects.get(pk=self.task1.pk)
+        updated_task = Task.objects.for_user(self.user1).get(pk=self.task1.pk)
         self.assertEqual(updated_task.title, 'Updated Test Task')
         self.assertEqual(updated_task.description, 'Updated description')
 
@@ -128,7 +169,7 @@ class TaskAPITests(APITestCase):
 
         # Should be unauthorized
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
-        self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(Task.objects.for_user(self.user1).count(), 2)
 
     def test_list_tasks_unauthenticated(self):
         """Test listing tasks without authentication"""
@@ -138,4 +179,878 @@ class TaskAPITests(APITestCase):
         response = client.get(self.list_create_url)
 
         # Should be unauthorized
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AdmissionControlTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+        self.client1 = APIClient()
+        self.client1.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @override_settings(REST_FRAMEWORK={
+        'DEFAULT_THROTTLE_CLASSES': [
+            'todos.throttling.UserTokenBucketThrottle',
+            'todos.throttling.IPTokenBucketThrottle',
+        ],
+        'DEFAULT_THROTTLE_RATES': {'tasks_user': '2/min', 'tasks_ip': '100/min'},
+    })
+    def test_task_requests_throttled_per_user(self):
+        """Test that a user is limited to their task bucket"""
+        url = reverse('task-list')
+
+        self.assertEqual(self.client1.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client1.get(url).status_code, status.HTTP_200_OK)
+
+        response = self.client1.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(REST_FRAMEWORK={
+        'DEFAULT_THROTTLE_CLASSES': [
+            'todos.throttling.UserTokenBucketThrottle',
+            'todos.throttling.IPTokenBucketThrottle',
+        ],
+        'DEFAULT_THROTTLE_RATES': {'auth_ip': '1/min', 'tasks_user': '100/min'},
+    })
+    def test_auth_budget_separate_from_tasks(self):
+        """Test that exhausting the auth budget leaves task endpoints usable"""
+        login_url = reverse('user-login')
+        credentials = {'username': 'testuser1', 'password': 'wrongpassword'}
+
+        self.client.post(login_url, credentials, format='json')
+        response = self.client.post(login_url, credentials, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client1.get(reverse('task-list')).status_code, status.HTTP_200_OK)
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'auth_ip': '2/min', 'tasks_user': '100/min'},
+    })
+    def test_auth_budget_ignores_spoofed_forwarded_for(self):
+        """Test that a new X-Forwarded-For per request does not get a new auth bucket"""
+        login_url = reverse('user-login')
+        credentials = {'username': 'testuser1', 'password': 'wrongpassword'}
+
+        statuses = [
+            self.client.post(
+                login_url, credentials, format='json', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}'
+            ).status_code
+            for i in range(4)
+        ]
+
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_concurrency_limit_sheds_load(self):
+        """Test that requests over the in-flight cap get a 503"""
+        middleware = ConcurrencyLimitMiddleware(lambda request: None)
+        slot = middleware.get_slot('/api/tasks/')
+        request = RequestFactory().get('/api/tasks/')
+
+        # Occupy every slot in the tasks budget
+        while slot.acquire(blocking=False):
+            pass
+
+        response = middleware(request)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIsNone(middleware.get_slot('/admin/'))
+
+    def test_shed_requests_keep_cors_headers(self):
+        """Test that a 503 from the concurrency limit is readable cross-origin"""
+        admission = {**settings.ADMISSION_CONTROL, 'CONCURRENCY': {'auth': 4, 'tasks': 0}}
+        with override_settings(ADMISSION_CONTROL=admission):
+            response = Client().get('/api/tasks/', HTTP_ORIGIN='http://localhost:5173')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'http://localhost:5173')
+
+    def test_bucket_stores_refill_at_the_steady_rate(self):
+        """Test that both bucket stores allow a burst, then one request per interval"""
+        for store in (CacheBucketStore(), DatabaseBucketStore()):
+            with self.subTest(store=type(store).__name__):
+                key = f'test_{type(store).__name__}'
+                # Burst of 3, refilled every 10 seconds
+                waits = [store.take(key, 1000.0, 10.0, 30.0) for _ in range(4)]
+                self.assertEqual(waits[:3], [0, 0, 0])
+                self.assertAlmostEqual(waits[3], 10.0)
+
+                self.assertAlmostEqual(store.take(key, 1005.0, 10.0, 30.0), 5.0)
+                self.assertEqual(store.take(key, 1010.0, 10.0, 30.0), 0)
+                self.assertGreater(store.take(key, 1010.0, 10.0, 30.0), 0)
+
+    @override_settings(THROTTLE_STORE='todos.throttling.DatabaseBucketStore', REST_FRAMEWORK={
+        'DEFAULT_THROTTLE_CLASSES': [
+            'todos.throttling.UserTokenBucketThrottle',
+            'todos.throttling.IPTokenBucketThrottle',
+        ],
+        'DEFAULT_THROTTLE_RATES': {'tasks_user': '2/min', 'tasks_ip': '100/min'},
+    })
+    def test_database_store_throttles_with_one_query_per_bucket(self):
+        """Test that the database store admits with a single statement per bucket"""
+        url = reverse('task-list')
+        self.client1.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client1.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            len([query for query in queries if 'todos_throttlebucket' in query['sql']]), 2
+        )
+
+        response = self.client1.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+
+
+class TaskAdminTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='adminpassword123'
+        )
+        self.client.force_login(self.admin_user)
+
+        self.tasks = [
+            Task.objects.create(user=self.admin_user, title=f'Task {i}', status='pending')
+            for i in range(5)
+        ]
+        self.shard = shard_for_user(self.admin_user)
+        self.changelist_url = reverse('admin:todos_task_changelist')
+
+    def test_changelist_keyset_navigation(self):
+        """Test paging through tasks by id cursor"""
+        with mock.patch.object(TaskAdmin, 'list_per_page', 2):
+            response = self.client.get(self.changelist_url, {'shard': self.shard})
+            cl = response.context['cl']
+            self.assertEqual([t.pk for t in cl.result_list], [self.tasks[4].pk, self.tasks[3].pk])
+            self.assertIsNone(cl.newer_url)
+
+            response = self.client.get(self.changelist_url + cl.older_url)
+            cl = response.context['cl']
+            self.assertEqual([t.pk for t in cl.result_list], [self.tasks[2].pk, self.tasks[1].pk])
+
+            response = self.client.get(self.changelist_url + cl.newer_url)
+            cl = response.context['cl']
+            self.assertEqual([t.pk for t in cl.result_list], [self.tasks[4].pk, self.tasks[3].pk])
+
+    def test_changelist_filter_and_search(self):
+        """Test status filter and title prefix search"""
+        Task.objects.using(self.shard).filter(pk=self.tasks[0].pk).update(status='completed', title='Other')
+
+        response = self.client.get(self.changelist_url, {'shard': self.shard, 'status__exact': 'completed'})
+        self.assertEqual([t.pk for t in response.context['cl'].result_list], [self.tasks[0].pk])
+
+        response = self.client.get(self.changelist_url, {'shard': self.shard, 'q': 'Oth'})
+        self.assertEqual([t.pk for t in response.context['cl'].result_list], [self.tasks[0].pk])
+
+    def test_changelist_search_is_one_prefix(self):
+        """Test that a multi-word search matches titles starting with the whole query"""
+        Task.objects.using(self.shard).filter(pk=self.tasks[0].pk).update(title='Buy milk today')
+        Task.objects.using(self.shard).filter(pk=self.tasks[1].pk).update(title='Buy bread, milk')
+
+        response = self.client.get(self.changelist_url, {'shard': self.shard, 'q': ' Buy milk '})
+
+        self.assertEqual([t.pk for t in response.context['cl'].result_list], [self.tasks[0].pk])
+
+    def change_parent(self, task, parent):
+        return self.client.post(reverse('admin:todos_task_change', args=[task.pk]), {
+            'title': task.title,
+            'description': task.description or '',
+            'completed': task.completed,
+            'priority': task.priority,
+            'status': task.status,
+            'user': task.user_id,
+            'position': task.position,
+            'parent': parent.pk if parent is not None else '',
+            'series': '',
+        })
+
+    def test_change_parent_moves_subtree(self):
+        """Test that changing a parent in the admin rewrites the subtree's paths"""
+        root, other_root, child = self.tasks[:3]
+        Task.objects.using(self.shard).filter(pk=child.pk).update(parent=root, path=f'{root.pk}/')
+        child.refresh_from_db()
+        grandchild = Task.objects.create(user=self.admin_user, title='Grandchild', parent=child)
+
+        response = self.change_parent(child, other_root)
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.ancestor_ids, [other_root.pk, child.pk])
+        self.assertEqual(list(root.descendants()), [])
+
+    def test_change_parent_rejects_invalid_parents(self):
+        """Test that the admin refuses parents the API would refuse"""
+        child = Task.objects.create(user=self.admin_user, title='Child', parent=self.tasks[0])
+        other = User.objects.create_user(username='other', password='otherpassword123')
+        with override_settings(TASK_SHARDS=[self.shard]):
+            foreign = Task.objects.create(user=other, title='Foreign')
+
+        for parent in (child, foreign):
+            with self.subTest(parent=parent.title):
+                response = self.change_parent(self.tasks[0], parent)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('parent', response.context['adminform'].form.errors)
+
+        self.tasks[0].refresh_from_db()
+        self.assertIsNone(self.tasks[0].parent_id)
+
+    def test_changelist_user_id_filter(self):
+        """Test filtering by user id without a join to the user table"""
+        other = User.objects.create_user(username='other', password='otherpassword123')
+        other_task = Task.objects.create(user=other, title='Task 0')
+
+        response = self.client.get(self.changelist_url, {'shard': shard_for_user(other), 'user': other.pk})
+        self.assertEqual([t.pk for t in response.context['cl'].result_list], [other_task.pk])
+        self.assertContains(response, f'value="{other.pk}"')
+
+        response = self.client.get(self.changelist_url, {'shard': self.shard, 'q': 'other'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_changelist_reads_one_shard(self):
+        """Test that the shard filter picks the database and rejects unknown shards"""
+        for shard in settings.TASK_SHARDS:
+            response = self.client.get(self.changelist_url, {'shard': shard})
+            expected = [t.pk for t in self.tasks[::-1]] if shard == self.shard else []
+            self.assertEqual([t.pk for t in response.context['cl'].result_list], expected)
+
+        response = self.client.get(self.changelist_url, {'shard': 'missing'})
+        self.assertRedirects(response, self.changelist_url + '?e=1', fetch_redirect_response=False)
+
+    def test_change_page_finds_task_on_its_shard(self):
+        """Test that change pages load tasks from whichever shard holds them"""
+        url = reverse('admin:todos_task_change', args=[self.tasks[0].pk])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['original'].pk, self.tasks[0].pk)
+        self.assertEqual(response.context['original']._state.db, self.shard)
+
+    def test_paginator_count_is_bounded(self):
+        """Test that counts stop at the paginator's limit"""
+        with mock.patch.object(EstimatedCountPaginator, 'count_limit', 3):
+            paginator = EstimatedCountPaginator(Task.objects.using(self.shard), 2)
+            self.assertEqual(paginator.count, 3)
+            self.assertTrue(paginator.is_capped)
+
+
+
+class MiddlewareProfileTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def test_api_skips_browser_middleware(self):
+        """Test that token API requests run without sessions or frame options"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        response = client.get(reverse('task-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertNotIn('X-Frame-Options', response)
+
+    def test_admin_keeps_full_stack(self):
+        """Test that the admin still gets sessions and CSRF protection"""
+        client = Client(enforce_csrf_checks=True)
+
+        response = client.get(reverse('admin:login'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+
+        response = client.post(reverse('admin:login'), {
+            'username': 'testuser1',
+            'password': 'testpassword123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_browsable_api_login_keeps_full_stack(self):
+        """Test that the browsable API login is served with sessions and CSRF protection"""
+        client = Client(enforce_csrf_checks=True)
+
+        response = client.get(reverse('rest_framework:login'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+
+        response = client.post(reverse('rest_framework:login'), {
+            'username': 'testuser1',
+            'password': 'testpassword123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+
+class TaskOrderingTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tasks = [
+            Task.objects.create(user=self.user, title=f'Task {i}')
+            for i in range(4)
+        ]
+
+        self.client1 = APIClient()
+        self.client1.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def manual_order(self):
+        response = self.client1.get(reverse('task-list'), {'ordering': 'manual'})
+        return [task['title'] for task in response.data]
+
+    def test_new_tasks_append_to_manual_order(self):
+        """Test that created tasks go to the end of the manual order"""
+        self.client1.post(reverse('task-list'), {'title': 'Task 4'}, format='json')
+
+        self.assertEqual(self.manual_order(), ['Task 0', 'Task 1', 'Task 2', 'Task 3', 'Task 4'])
+
+    def test_move_task_rewrites_only_that_task(self):
+        """Test moving a task before and after other tasks, writing its row and the order lock"""
+        url = reverse('task-move', kwargs={'pk': self.tasks[3].pk})
+
+        with capture_all_queries() as queries:
+            # auth, shard lookup, get_object, savepoint, order lock, anchor, neighbour, update, release
+            response = self.client1.post(url, {'before': self.tasks[0].pk}, format='json')
+        self.assertEqual(len(queries), 8 + SHARD_LOOKUPS)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.manual_order(), ['Task 3', 'Task 0', 'Task 1', 'Task 2'])
+
+        url = reverse('task-move', kwargs={'pk': self.tasks[0].pk})
+        self.client1.post(url, {'after': self.tasks[1].pk}, format='json')
+        self.assertEqual(self.manual_order(), ['Task 3', 'Task 1', 'Task 0', 'Task 2'])
+
+    def test_moves_to_top_keep_keys_short(self):
+        """Test that moving tasks to the top steps the integer part down instead of bisecting"""
+        top = self.tasks[0]
+        for _ in range(20):
+            for task in self.tasks[2:]:
+                url = reverse('task-move', kwargs={'pk': task.pk})
+                response = self.client1.post(url, {'before': top.pk}, format='json')
+                self.assertLessEqual(len(response.data['position']), 3)
+                top = task
+        self.assertEqual(self.manual_order(), ['Task 3', 'Task 2', 'Task 0', 'Task 1'])
+
+        key = self.tasks[0].position
+        for _ in range(2000):
+            lower = key_between(None, key)
+            self.assertLess(lower, key)
+            key = lower
+        self.assertEqual(len(key), 4)
+
+    def test_move_task_requires_one_anchor(self):
+        """Test that a move needs exactly one of before/after"""
+        url = reverse('task-move', kwargs={'pk': self.tasks[0].pk})
+
+        response = self.client1.post(url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client1.post(url, {'after': self.tasks[0].pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_move_rebalances_when_key_would_not_fit(self):
+        """Test that a move rebalances first if its key would overflow the column"""
+        Task.objects.for_user(self.user).filter(pk=self.tasks[1].pk).update(position='a1' + '0' * 252 + '1')
+        url = reverse('task-move', kwargs={'pk': self.tasks[3].pk})
+
+        response = self.client1.post(url, {'after': self.tasks[0].pk}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.manual_order(), ['Task 0', 'Task 3', 'Task 1', 'Task 2'])
+        self.assertLessEqual(len(response.data['position']), 3)
+
+    def test_rebalance_preserves_order(self):
+        """Test that rebalancing shortens keys without reordering"""
+        # Repeatedly squeeze a task between the first two
+        lower, upper = self.tasks[0].position, self.tasks[1].position
+        for _ in range(40):
+            upper = key_between(lower, upper)
+        Task.objects.for_user(self.user).filter(pk=self.tasks[3].pk).update(position=upper)
+        before = self.manual_order()
+
+        Task.rebalance_positions(self.user.id)
+
+        self.assertEqual(self.manual_order(), before)
+        positions = Task.objects.for_user(self.user).values_list('position', flat=True)
+        self.assertTrue(all(len(position) <= 2 for position in positions))
+
+
+class TaskHierarchyTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+        # root -> child -> grandchild, root -> sibling
+        self.root = Task.objects.create(user=self.user, title='Root')
+        self.child = Task.objects.create(user=self.user, title='Child', parent=self.root)
+        self.grandchild = Task.objects.create(
+            user=self.user, title='Grandchild', parent=self.child, status='completed'
+        )
+        self.sibling = Task.objects.create(user=self.user, title='Sibling', parent=self.root)
+
+        self.client1 = APIClient()
+        self.client1.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_create_subtask(self):
+        """Test creating a task under a parent"""
+        response = self.client1.post(
+            reverse('task-list'), {'title': 'Leaf', 'parent': self.grandchild.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['depth'], 3)
+        leaf = Task.objects.for_user(self.user).get(pk=response.data['id'])
+        self.assertEqual(leaf.ancestor_ids, [self.root.pk, self.child.pk, self.grandchild.pk])
+
+    def test_subtree_with_rollups(self):
+        """Test fetching a nested subtree with completion counts"""
+        url = reverse('task-subtree', kwargs={'pk': self.root.pk})
+
+        with capture_all_queries() as queries:
+            # auth, shard lookup, get_object, subtree
+            response = self.client1.get(url)
+        self.assertEqual(len(queries), 3 + SHARD_LOOKUPS)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['subtask_count'], 3)
+        self.assertEqual(response.data['completed_subtask_count'], 1)
+        child, sibling = response.data['children']
+        self.assertEqual(child['title'], 'Child')
+        self.assertEqual(child['children'][0]['title'], 'Grandchild')
+        self.assertEqual(sibling['children'], [])
+
+    def test_ancestors(self):
+        """Test fetching the chain of parents"""
+        url = reverse('task-ancestors', kwargs={'pk': self.grandchild.pk})
+
+        response = self.client1.get(url)
+
+        self.assertEqual([task['title'] for task in response.data], ['Root', 'Child'])
+
+    def test_move_subtree(self):
+        """Test that moving a task rewrites its descendants' paths"""
+        url = reverse('task-detail', kwargs={'pk': self.child.pk})
+
+        response = self.client1.patch(url, {'parent': self.sibling.pk}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(
+            self.grandchild.ancestor_ids, [self.root.pk, self.sibling.pk, self.child.pk]
+        )
+
+        response = self.client1.patch(url, {'parent': None}, format='json')
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.ancestor_ids, [self.child.pk])
+
+    def test_move_under_own_subtree_rejected(self):
+        """Test that a task cannot become its own descendant"""
+        url = reverse('task-detail', kwargs={'pk': self.root.pk})
+
+        response = self.client1.patch(url, {'parent': self.grandchild.pk}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_nesting_limited_by_path_length(self):
+        """Test that creates and moves that would overflow the path are rejected"""
+        def pad_subtree_path(length):
+            # Give the sibling's children a path of exactly `length` characters
+            length -= len(f'{self.sibling.pk}/')
+            path = '1/' * (length // 2) if length % 2 == 0 else '12/' + '1/' * ((length - 3) // 2)
+            Task.objects.for_user(self.user).filter(pk=self.sibling.pk).update(path=path)
+
+        # The child fits under the sibling, but its grandchild would not
+        pad_subtree_path(1000)
+        response = self.client1.patch(
+            reverse('task-detail', kwargs={'pk': self.child.pk}), {'parent': self.sibling.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('nested', str(response.data['parent']))
+
+        response = self.client1.post(
+            reverse('task-list'), {'title': 'Leaf', 'parent': self.sibling.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        pad_subtree_path(1001)
+        response = self.client1.post(
+            reverse('task-list'), {'title': 'Leaf', 'parent': self.sibling.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_subtree(self):
+        """Test that deleting a task removes its subtasks"""
+        url = reverse('task-detail', kwargs={'pk': self.child.pk})
+
+        response = self.client1.delete(url)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            list(Task.objects.for_user(self.user).order_by('pk').values_list('title', flat=True)),
+            ['Root', 'Sibling']
+        )
+
+
+class RecurringTaskTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+        self.client1 = APIClient()
+        self.client1.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        # A daily series running for ten years
+        response = self.client1.post(reverse('recurring-task-list'), {
+            'title': 'Standup',
+            'frequency': 'daily',
+            'starts_at': '2026-01-01T09:00:00Z',
+            'until': '2035-12-31T09:00:00Z',
+        }, format='json')
+        self.series = RecurringTask.objects.for_user(self.user).get(pk=response.data['id'])
+
+        Task.objects.create(
+            user=self.user, title='Dentist', due_date=self.series.starts_at + timedelta(days=1, hours=3)
+        )
+
+    def agenda(self, **params):
+        return self.client1.get(reverse('task-list'), {'start': '2026-01-01T00:00:00Z', **params})
+
+    def test_occurrences_generated_lazily(self):
+        """Test that occurrences are listed without being stored"""
+        response = self.agenda(limit=4)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [task['title'] for task in response.data['results']],
+            ['Standup', 'Standup', 'Dentist', 'Standup']
+        )
+        self.assertEqual(Task.objects.for_user(self.user).count(), 1)
+
+        response = self.agenda(limit=2, cursor=response.data['next'])
+        self.assertEqual(
+            [task['occurrence'] for task in response.data['results']],
+            ['2026-01-04T09:00:00Z', '2026-01-05T09:00:00Z']
+        )
+
+    def test_invalid_cursors_rejected(self):
+        """Test that naive, malformed or out of range cursors get a 400"""
+        for cursor in ('2026-01-02T00:00:00,0,1', '2026-01-02T00:00:00+00:00,7,1', 'garbage'):
+            with self.subTest(cursor=cursor):
+                response = self.agenda(cursor=cursor)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(response.data['cursor'], ['Invalid cursor.'])
+
+        response = self.agenda(cursor='9999-12-31T00:00:00+00:00,1,1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_late_window_skips_ahead(self):
+        """Test that a window years into the series starts at the right occurrence"""
+        response = self.client1.get(reverse('task-list'), {
+            'start': '2034-06-01T00:00:00Z', 'end': '2034-06-03T00:00:00Z'
+        })
+
+        self.assertEqual(
+            [task['due_date'] for task in response.data['results']],
+            ['2034-06-01T09:00:00Z', '2034-06-02T09:00:00Z']
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_complete_occurrence_stores_override(self):
+        """Test that changing an occurrence stores only that occurrence"""
+        url = reverse('recurring-task-occurrences', kwargs={'pk': self.series.pk})
+
+        response = self.client1.post(
+            url, {'occurrence': '2026-01-02T09:00:00Z', 'status': 'completed'}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.series.overrides.count(), 1)
+
+        results = self.agenda(limit=3).data['results']
+        self.assertEqual(
+            [(task['occurrence'], task['status']) for task in results],
+            [
+                ('2026-01-01T09:00:00Z', 'pending'),
+                ('2026-01-02T09:00:00Z', 'completed'),
+                (None, 'pending'),
+            ]
+        )
+
+        pending = self.agenda(limit=2, status='pending').data['results']
+        self.assertEqual(
+            [task['due_date'] for task in pending],
+            ['2026-01-01T09:00:00Z', '2026-01-02T12:00:00Z']
+        )
+
+    def test_override_occurrence_under_parent(self):
+        """Test that a new override can be created, and later moved, under a parent task"""
+        url = reverse('recurring-task-occurrences', kwargs={'pk': self.series.pk})
+        parent = Task.objects.create(user=self.user, title='Project')
+        other_parent = Task.objects.create(user=self.user, title='Other project')
+
+        response = self.client1.post(
+            url, {'occurrence': '2026-01-05T09:00:00Z', 'parent': parent.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['depth'], 1)
+        self.assertEqual([task.pk for task in parent.descendants()], [response.data['id']])
+
+        response = self.client1.post(
+            url, {'occurrence': '2026-01-05T09:00:00Z', 'parent': other_parent.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(parent.descendants()), [])
+        self.assertEqual([task.pk for task in other_parent.descendants()], [response.data['id']])
+
+    def test_invalid_occurrence_rejected(self):
+        """Test that only real occurrences can be overridden"""
+        url = reverse('recurring-task-occurrences', kwargs={'pk': self.series.pk})
+
+        response = self.client1.post(url, {'occurrence': '2026-01-02T10:00:00Z'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_monthly_occurrences_clamp_to_month_end(self):
+        """Test that monthly series on the 31st fall on shorter month ends"""
+        series = RecurringTask(
+            user=self.user, title='Report', frequency='monthly',
+            starts_at=datetime(2026, 1, 31, 9, tzinfo=dt_timezone.utc)
+        )
+
+        occurrences = list(islice(series.occurrences(start=datetime(2026, 2, 1, tzinfo=dt_timezone.utc)), 2))
+
+        self.assertEqual([when.date() for when in occurrences], [date(2026, 2, 28), date(2026, 3, 31)])
+
+
+class TaskHistoryTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+        self.user = User.objects.create_user(
+            username='testuser1',
+            email='test1@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.task = Task.objects.create(user=self.user, title='Test Task 1', priority='high')
+
+        self.client1 = APIClient()
+        self.client1.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.detail_url = reverse('task-detail', kwargs={'pk': self.task.pk})
+        self.history_url = reverse('task-history', kwargs={'pk': self.task.pk})
+
+    def test_history_stores_changed_fields_only(self):
+        """Test that updates log only the fields that changed"""
+        self.client1.patch(self.detail_url, {'title': 'Renamed', 'priority': 'high'}, format='json')
+        self.client1.patch(
+            reverse('task-update-status', kwargs={'pk': self.task.pk}), {'status': 'completed'}, format='json'
+        )
+
+        response = self.client1.get(self.history_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([change['changes'] for change in response.data], [
+            {'title': ['Test Task 1', 'Renamed']},
+            {'status': ['pending', 'completed'], 'completed': [False, True]},
+        ])
+
+    def test_history_outlives_deleted_task(self):
+        """Test that deleting a task is logged"""
+        self.client1.delete(self.detail_url)
+
+        change = TaskChange.objects.for_user(self.user).get(task_id=self.task.pk)
+        self.assertEqual(change.action, 'delete')
+
+    def test_deleting_subtree_logs_every_task(self):
+        """Test that deleting a task also logs the deletion of its subtasks"""
+        child = Task.objects.create(user=self.user, title='Child', parent=self.task)
+        grandchild = Task.objects.create(user=self.user, title='Grandchild', parent=child)
+
+        self.client1.delete(self.detail_url)
+
+        self.assertEqual(
+            sorted(TaskChange.objects.for_user(self.user).filter(action='delete').values_list('task_id', flat=True)),
+            [self.task.pk, child.pk, grandchild.pk]
+        )
+
+    def test_failed_flush_is_requeued(self):
+        """Test that rows from a failed flush are kept and written by the next one"""
+        change_log.record(self.task, self.user, 'update', {'title': ['a', 'b']})
+
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError):
+            with self.assertLogs('todos.history', 'ERROR'):
+                self.assertEqual(change_log.buffer.flush(), 0)
+        self.assertEqual(TaskChange.objects.for_user(self.user).count(), 0)
+
+        self.assertEqual(change_log.buffer.flush(), 1)
+        self.assertEqual(TaskChange.objects.for_user(self.user).count(), 1)
+
+    def test_buffered_changes_flush_by_size(self):
+        """Test that buffered changes are written in one batch once the buffer fills"""
+        with override_settings(TASK_HISTORY={'MODE': 'buffered', 'MAX_BUFFER': 3, 'FLUSH_INTERVAL': 60}):
+            for i in range(2):
+                change_log.record(self.task, self.user, 'update', {'title': [str(i), str(i + 1)]})
+            self.assertEqual(TaskChange.objects.for_user(self.user).count(), 0)
+
+            with self.assertNumQueries(1, using=self.task._state.db):
+                change_log.record(self.task, self.user, 'update', {'title': ['2', '3']})
+            self.assertEqual(TaskChange.objects.for_user(self.user).count(), 3)
+
+    def test_sync_mode_writes_immediately(self):
+        """Test that sync mode writes each change as it happens"""
+        with override_settings(TASK_HISTORY={'MODE': 'sync', 'MAX_BUFFER': 500, 'FLUSH_INTERVAL': 60}):
+            change_log.record(self.task, self.user, 'update', {'title': ['a', 'b']})
+
+        self.assertEqual(TaskChange.objects.for_user(self.user).count(), 1)
+
+
+# The whole suite also runs with --settings=todo_app_be.settings.test_sharded
+requires_shards = skipUnless(len(settings.TASK_SHARDS) > 1, 'needs several TASK_SHARDS')
+
+
+class ShardingTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def create_user(self, username):
+        user = User.objects.create_user(username=username, password='testpassword123')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return user, client
+
+    def shards_holding(self, model, **filters):
+        return [
+            using for using in settings.TASK_SHARDS
+            if model.objects.using(using).filter(**filters).exists()
+        ]
+
+    def test_adding_a_shard_only_moves_users_onto_it(self):
+        """Test that the hash ring spreads users and is stable as shards are added"""
+        before = HashRing(['a', 'b'])
+        after = HashRing(['a', 'b', 'c'])
+
+        placements = [(before.get_shard(i), after.get_shard(i)) for i in range(3000)]
+        moved = [new for old, new in placements if old != new]
+
+        self.assertTrue(set(moved) <= {'c'})
+        self.assertTrue(600 < len(moved) < 1400)
+
+    @requires_shards
+    def test_tasks_are_stored_on_the_users_shard(self):
+        """Test that each user's tasks are created and served from their own shard"""
+        users = [self.create_user(f'sharded{i}') for i in range(12)]
+        self.assertGreater(len({ring_shard(user.pk) for user, _ in users}), 1)
+
+        for user, client in users:
+            shard = UserShard.objects.get(user=user).shard
+            self.assertEqual(shard, ring_shard(user.pk))
+
+            response = client.post(reverse('task-list'), {'title': user.username}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            task_id = response.data['id']
+            self.assertEqual(task_id // SHARD_ID_SPAN, settings.TASK_SHARDS.index(shard))
+            self.assertEqual(self.shards_holding(Task, pk=task_id), [shard])
+
+            response = client.post(
+                reverse('task-list'), {'title': 'Subtask', 'parent': task_id}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = client.get(reverse('task-subtree', kwargs={'pk': task_id}))
+            self.assertEqual(response.data['subtask_count'], 1)
+
+            response = client.get(reverse('task-list'))
+            self.assertCountEqual([task['title'] for task in response.data], [user.username, 'Subtask'])
+
+    @requires_shards
+    def test_rebalance_moves_users_to_added_shard(self):
+        """Test that rebalance_shards moves users onto a new shard, resuming after a failure"""
+        with override_settings(TASK_SHARDS=settings.TASK_SHARDS[:-1]):
+            users = [self.create_user(f'rebalanced{i}') for i in range(12)]
+            for user, client in users:
+                response = client.post(reverse('task-list'), {'title': user.username}, format='json')
+                client.post(
+                    reverse('task-list'), {'title': 'Subtask', 'parent': response.data['id']}, format='json'
+                )
+                client.patch(
+                    reverse('task-detail', kwargs={'pk': response.data['id']}), {'title': 'Renamed'}, format='json'
+                )
+
+        new_shard = settings.TASK_SHARDS[-1]
+        moving = [(user, client) for user, client in users if ring_shard(user.pk) == new_shard]
+        self.assertTrue(moving)
+
+        # Fail after switching the first user over, before the old shard is cleaned up
+        with mock.patch.object(
+            RebalanceShardsCommand, 'delete_rows', autospec=True, side_effect=[None, RuntimeError]
+        ):
+            with self.assertRaises(RuntimeError):
+                call_command('rebalance_shards', stdout=StringIO())
+        call_command('rebalance_shards', stdout=StringIO())
+
+        for user, client in users:
+            pin = UserShard.objects.get(user=user)
+            self.assertEqual((pin.shard, pin.previous), (ring_shard(user.pk), None))
+            self.assertEqual(self.shards_holding(Task, user_id=user.pk), [pin.shard])
+            self.assertEqual(self.shards_holding(TaskChange, user_id=user.pk), [pin.shard])
+
+            response = client.get(reverse('task-list'), {'ordering': 'manual'})
+            self.assertEqual([task['title'] for task in response.data], ['Renamed', 'Subtask'])
+            response = client.get(reverse('task-history', kwargs={'pk': response.data[0]['id']}))
+            self.assertEqual(len(response.data), 1)
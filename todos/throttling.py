@@ -0,0 +1,203 @@
+"""
+Token bucket throttling for the API.
+
+Buckets are kept as a GCRA "theoretical arrival time" (TAT): the time at
+which the bucket would be full again. A request is admitted if advancing the
+TAT by one refill interval keeps it within the burst allowance, which gives
+exactly token bucket behaviour with a single number per bucket. That number
+can be updated atomically, so concurrent requests never spend the same token.
+
+Two stores are provided (see `THROTTLE_STORE` in settings):
+
+- `CacheBucketStore` keeps the TAT in the `throttle` cache using `add` and
+  `incr`. The cache's `incr` must be atomic (local memory, Redis, Memcached),
+  which rules out the database cache.
+- `DatabaseBucketStore` keeps it in the `ThrottleBucket` table, updated with
+  one upsert per request, for sharing buckets between serverless instances.
+"""
+import random
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import ThrottleBucket
+
+
+class CacheBucketStore:
+    """
+    Buckets in the `throttle` cache, as integer microseconds.
+
+    Each bucket expires once it is full again, so an existing entry always
+    lies in the future and advancing it is a plain atomic `incr`.
+    """
+    cache_alias = 'throttle'
+
+    def __init__(self):
+        self.cache = caches[self.cache_alias]
+
+    def take(self, key, now, interval, burst):
+        """
+        Take one token; return 0 if admitted, else seconds until one is free.
+        """
+        now, interval, burst = int(now * 1e6), int(interval * 1e6), int(burst * 1e6)
+        while True:
+            try:
+                tat = self.cache.incr(key, interval)
+                break
+            except ValueError:
+                # Missing or full again: start a new bucket with one token spent
+                if self.cache.add(key, now + interval, timeout=interval / 1e6):
+                    return 0
+
+        if tat - now > burst:
+            # Give the token back; nothing was admitted
+            try:
+                self.cache.decr(key, interval)
+            except ValueError:
+                pass
+            return (tat - now - burst) / 1e6
+
+        self.cache.touch(key, timeout=(tat - now) / 1e6)
+        return 0
+
+
+class DatabaseBucketStore:
+    """
+    Buckets in the `ThrottleBucket` table on the directory database.
+
+    Each request runs a single `INSERT ... ON CONFLICT DO UPDATE ... RETURNING`
+    that only advances the TAT if the request is admitted (PostgreSQL and
+    SQLite 3.35+). Full buckets are deleted now and then.
+    """
+    # Chance that a request deletes the buckets that are full again
+    cull_probability = 0.001
+
+    def take(self, key, now, interval, burst):
+        """
+        Take one token; return 0 if admitted, else seconds until one is free.
+        """
+        connection = connections[router.db_for_write(ThrottleBucket)]
+        table = connection.ops.quote_name(ThrottleBucket._meta.db_table)
+        column = f'{table}.{connection.ops.quote_name("tat")}'
+        current = f'(CASE WHEN {column} > %s THEN {column} ELSE %s END)'
+
+        with connection.cursor() as cursor:
+            if random.random() < self.cull_probability:
+                cursor.execute(f'DELETE FROM {table} WHERE tat <= %s', [now])
+
+            cursor.execute(
+                f'INSERT INTO {table} (bucket, tat) VALUES (%s, %s) '
+                f'ON CONFLICT (bucket) DO UPDATE SET tat = {current} + %s '
+                f'WHERE {current} + %s - %s <= %s '
+                f'RETURNING tat',
+                [key, now + interval, now, now, interval, now, now, interval, now, burst],
+            )
+            if cursor.fetchone() is not None:
+                return 0
+
+            # Denied (rare): read the TAT to say when to come back
+            cursor.execute(f'SELECT tat FROM {table} WHERE bucket = %s', [key])
+            row = cursor.fetchone()
+        if row is None:
+            return interval
+        return max(row[0], now) + interval - now - burst
+
+
+@lru_cache(maxsize=None)
+def get_store(path):
+    return import_string(path)()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle keyed by the view's `throttle_scope`.
+
+    A rate of 'N/period' gives a bucket of N tokens refilled continuously at
+    N tokens per period, so clients can burst up to N requests and are then
+    held to the steady rate. Buckets live in the store named by
+    `THROTTLE_STORE`.
+
+    Views without a `throttle_scope` are not throttled.
+    """
+    cache_format = 'bucket_%(scope)s_%(ident)s'
+    scope_suffix = None
+
+    def __init__(self):
+        # The rate depends on the view, so it is resolved in allow_request.
+        pass
+
+    @property
+    def store(self):
+        return get_store(settings.THROTTLE_STORE)
+
+    @property
+    def THROTTLE_RATES(self):
+        return api_settings.DEFAULT_THROTTLE_RATES
+
+    def allow_request(self, request, view):
+        """
+        Take one token from the bucket, refilling it for the time elapsed
+        since the last request.
+        """
+        view_scope = getattr(view, 'throttle_scope', None)
+        if not view_scope:
+            return True
+
+        self.scope = f'{view_scope}_{self.scope_suffix}'
+        if self.scope not in self.THROTTLE_RATES:
+            return True
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        interval = self.duration / self.num_requests
+        self.wait_time = self.store.take(
+            self.key, self.timer(), interval, self.num_requests * interval
+        )
+        return not self.wait_time
+
+    def wait(self):
+        """
+        Seconds until the bucket holds a full token again.
+        """
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Per-user bucket, using the `<scope>_user` rate.
+
+    Anonymous requests are left to `IPTokenBucketThrottle`.
+    """
+    scope_suffix = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': request.user.pk,
+        }
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Per-client-address bucket, using the `<scope>_ip` rate.
+    """
+    scope_suffix = 'ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TaskViewSet, UserRegistrationView, UserLoginView, UserLogoutView,CurrentUserView
+from .views import RecurringTaskViewSet, TaskViewSet, UserRegistrationView, UserLoginView, UserLogoutView,CurrentUserView
 
 router = DefaultRouter()
 router.register(r'tasks', TaskViewSet, basename='task')
+router.register(r'recurring-tasks', RecurringTaskViewSet, basename='recurring-task')
 
 urlpatterns = [
     path('', include(router.urls)),
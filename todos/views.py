@@ -1,13 +1,24 @@
-from rest_framework import viewsets, permissions, status
+from itertools import islice
+
+from rest_framework import viewsets, permissions, serializers, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
 from django.contrib.auth import authenticate
+from django.db import transaction
 
-from .serializers import TaskSerializer, UserRegistrationSerializer, UserLoginSerializer
-from .models import Task
+from .serializers import (
+    AgendaQuerySerializer, RecurringTaskSerializer, TaskChangeSerializer, TaskSerializer, TaskTreeSerializer,
+    UserRegistrationSerializer, UserLoginSerializer,
+)
+from . import history as change_log
+from .models import RecurringTask, Task, TaskChange, TaskOrderLock
+from .recurrence import agenda, encode_cursor
+from .ordering import key_between
+from .throttling import IPTokenBucketThrottle
 
 
 class TaskViewSet(viewsets.ModelViewSet):
@@ -16,13 +27,18 @@ class TaskViewSet(viewsets.ModelViewSet):
     """
     serializer_class = TaskSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'tasks'
 
     def get_queryset(self):
         """
         This view should return a list of all tasks
         for the currently authenticated user.
+        Pass `?ordering=manual` to get them in the user's manual order.
         """
-        return Task.objects.filter(user=self.request.user)
+        queryset = Task.objects.for_user(self.request.user)
+        if self.request.query_params.get('ordering') == 'manual':
+            queryset = queryset.order_by('position', 'id')
+        return queryset
 
     def get_serializer_context(self):
         """
@@ -38,6 +54,35 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         serializer.save()
 
+    def list(self, request, *args, **kwargs):
+        """
+        List tasks. Pass `?start=` (and optionally `end`, `status`, `limit`
+        and `cursor`) to list the agenda for that window instead, with
+        occurrences of recurring tasks merged in by due date.
+        """
+        if 'start' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        query = AgendaQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        limit = params['limit']
+
+        entries = list(islice(agenda(
+            request.user,
+            params['start'],
+            end=params.get('end'),
+            status=params.get('status'),
+            after=params.get('cursor'),
+        ), limit + 1))
+
+        page = entries[:limit]
+        serializer = self.get_serializer([task for _, task in page], many=True)
+        return Response({
+            'next': encode_cursor(page[-1][0]) if len(entries) > limit else None,
+            'results': serializer.data,
+        })
+
     def update(self, request, *args, **kwargs):
         """
         Update an existing task
@@ -46,7 +91,9 @@ class TaskViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(request, instance)
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
+        before = change_log.snapshot(instance)
         self.perform_update(serializer)
+        change_log.record(instance, request.user, 'update', change_log.diff(before, instance))
         return Response(serializer.data)
 
     @action(detail=True, methods=['patch'])
@@ -64,6 +111,7 @@ class TaskViewSet(viewsets.ModelViewSet):
             )
 
         # Update the status
+        before = change_log.snapshot(task)
         task.status = new_status
 
         # Auto-update completed field if status is 'completed'
@@ -73,26 +121,185 @@ class TaskViewSet(viewsets.ModelViewSet):
             task.completed = False
 
         task.save()
+        change_log.record(task, request.user, 'update', change_log.diff(before, task))
 
         # Return the updated task
         serializer = self.get_serializer(task)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """
+        Move a task directly after or before another task in the manual
+        order. Two rows are written: the moved task's position and the
+        user's TaskOrderLock, which keeps the move from interleaving with an
+        append or a rebalance. No other task is rewritten.
+
+        Keys that grow past REBALANCE_LENGTH are shortened by the scheduled
+        `rebalance_positions` command; a move is only rebalanced inline if its
+        key would not fit in the column.
+        """
+        task = self.get_object()
+
+        after_id = request.data.get('after')
+        before_id = request.data.get('before')
+        if (after_id is None) == (before_id is None):
+            return Response(
+                {'error': "Provide exactly one of 'after' or 'before'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        using = task._state.db
+        others = Task.objects.for_user(request.user).exclude(pk=task.pk)
+        with transaction.atomic(using=using):
+            # Keys read below must not be rewritten before this move commits
+            TaskOrderLock.acquire(request.user.pk, using)
+            try:
+                anchor = others.get(pk=after_id if after_id is not None else before_id)
+            except (Task.DoesNotExist, ValueError, TypeError):
+                return Response(
+                    {'error': 'Target task not found.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            position = move_key(others, anchor, after=after_id is not None)
+            if len(position) > Task._meta.get_field('position').max_length:
+                Task.rebalance_positions(request.user.pk)
+                anchor.refresh_from_db(fields=['position'])
+                position = move_key(others, anchor, after=after_id is not None)
+
+            task.position = position
+            task.save(update_fields=['position', 'updated_at'])
+
+        serializer = self.get_serializer(task)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, pk=None):
+        """
+        Return a task with all of its subtasks nested under it, fetched in
+        a single query, with completion counts rolled up at every level.
+        """
+        task = self.get_object()
+        subtree = task.descendants().order_by('position', 'id')
+        serializer = TaskTreeSerializer(
+            task, context={**self.get_serializer_context(), 'subtree': subtree}
+        )
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def ancestors(self, request, pk=None):
+        """
+        Return the chain of parent tasks from the top-level task down.
+        """
+        task = self.get_object()
+        ancestor_ids = task.ancestor_ids
+        ancestors = Task.objects.for_user(request.user).filter(pk__in=ancestor_ids).in_bulk()
+        serializer = self.get_serializer(
+            [ancestors[pk] for pk in ancestor_ids if pk in ancestors], many=True
+        )
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Return the change log of a task, oldest first.
+        """
+        task = self.get_object()
+        # Include changes still waiting in the write-behind buffer
+        change_log.buffer.flush()
+        changes = TaskChange.objects.for_user(request.user).filter(task_id=task.pk)
+        serializer = TaskChangeSerializer(changes, many=True)
+        return Response(serializer.data)
+
     def destroy(self, request, *args, **kwargs):
         """
-        Delete a task
+        Delete a task along with all of its subtasks
         """
         instance = self.get_object()
         self.check_object_permissions(request, instance)
-        self.perform_destroy(instance)
+        change_log.record_deleted(instance, request.user)
+        # Delete the whole subtree at once rather than cascading level by level
+        (Task.objects.using(instance._state.db).filter(pk=instance.pk) | instance.descendants()).delete()
         return Response({'message': 'Task deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
 
 
+class RecurringTaskViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint that allows recurring tasks to be viewed or edited.
+    """
+    serializer_class = RecurringTaskSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'tasks'
+
+    def get_queryset(self):
+        """
+        Return the recurring tasks of the currently authenticated user.
+        """
+        return RecurringTask.objects.for_user(self.request.user).order_by('starts_at', 'id')
+
+    @action(detail=True, methods=['post'])
+    def occurrences(self, request, pk=None):
+        """
+        Change a single occurrence, saving it as a task that overrides the
+        series at that date. Send `occurrence` plus any task fields; use
+        status 'completed' to complete it or 'cancelled' to skip it.
+        """
+        series = self.get_object()
+
+        occurrence = serializers.DateTimeField().run_validation(request.data.get('occurrence'))
+        if not series.is_occurrence(occurrence):
+            return Response(
+                {'occurrence': ['Not an occurrence of this recurring task.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        task = Task.objects.using(series._state.db).filter(series=series, occurrence=occurrence).first()
+        created = task is None
+        if created:
+            task = series.build_occurrence(occurrence)
+
+        serializer = TaskSerializer(
+            task, data=request.data, partial=True, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+
+def move_key(others, anchor, after):
+    """
+    Return a position key directly after (or before) `anchor` among `others`
+    """
+    # Look up the anchor's neighbour on the other side
+    if after:
+        lower = anchor.position
+        upper = (
+            others.filter(position__gt=anchor.position)
+            .order_by('position', 'id')
+            .values_list('position', flat=True)
+            .first()
+        )
+    else:
+        upper = anchor.position
+        lower = (
+            others.filter(position__lt=anchor.position)
+            .order_by('-position', '-id')
+            .values_list('position', flat=True)
+            .first()
+        )
+    return key_between(lower or None, upper or None)
+
+
 class UserRegistrationView(APIView):
     """
     API endpoint for user registration
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'auth'
 
     def post(self, request):
         """
@@ -122,6 +329,7 @@ class UserLoginView(APIView):
     API endpoint for user login
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'auth'
 
     def post(self, request):
         """
@@ -159,6 +367,14 @@ class UserLoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class TokenAuthView(ObtainAuthToken):
+    """
+    DRF's token endpoint, throttled with the auth budget
+    """
+    throttle_classes = [IPTokenBucketThrottle]
+    throttle_scope = 'auth'
+
+
 class UserLogoutView(APIView):
     """
     API endpoint for user logout